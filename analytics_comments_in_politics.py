@@ -1,6 +1,5 @@
 import json
 import os
-import pickle
 from math import sqrt
 
 from sklearn.cluster import DBSCAN
@@ -9,6 +8,7 @@ from sklearn.manifold import TSNE
 
 from drawing import draw_tsne_result
 from performance.caching import save_code_based_cache
+from storage.comment_store import open_comment_store, ROOT_PARENT, MISSING_PARENT
 
 
 compute_interuser_affinity_configs = {
@@ -39,48 +39,49 @@ def add_in_weights_dict(data, username, weight):
     else:
         data[username] = weight
 
-def get_users_for_record(record):
+def get_users_for_record(data, post_idx):
     usernames = set()
-    usernames.add(record["author"])
-    for comment in record["comments"]:
-        usernames.add(comment["user"])
+    usernames.add(data.post_author(post_idx))
+    for row in data.post_comment_rows(post_idx):
+        usernames.add(data.comment_user(row))
     return usernames
 
 def get_posts_for_users(data, filter_usernames):
     posts = []
     intersection_users = []
-    for i, record in enumerate(data.values()):
-        current_usernames = get_users_for_record(record)
+    for post_idx in range(data.number_of_posts):
+        current_usernames = get_users_for_record(data, post_idx)
         current_intersection_users = filter_usernames.intersection(current_usernames)
         if len(current_intersection_users) > 0:
-            posts.append(record)
+            posts.append({"link" : data.links[post_idx]})
             intersection_users.append(current_intersection_users)
     return posts, intersection_users
 
 @save_code_based_cache("politics_users.pkl")
 def get_weight_filtered_users(data, post_weight, comment_weight, threshold, **kwargs):
-    users = {}
-    for record in data.values():
-        current_post_users = {}
-        add_in_weights_dict(users, record["author"], post_weight)
-        add_in_weights_dict(current_post_users, record["author"], 1)
-        for comment in record["comments"]:
-            user = comment["user"]
-            divider = sqrt(1 + current_post_users[user]) if user in current_post_users else 1.0
-            add_in_weights_dict(users, record["author"], comment_weight/divider)
-            add_in_weights_dict(current_post_users, record["author"], 1)
-    return {k: v for (k, v) in users.items() if v > threshold}
-
-
-def traverse_comments_branch(affinity_mat, comment_to_comment_value, users_weights, users_names, record, user_name, user_idx, author_name, author_idx, current_comment, current_depth):
-    parent_comment = None
+    # Every post credits its author with post_weight and every comment credits the post author with
+    # comment_weight, dampened by sqrt(number of preceding post entries + 1) for author's own comments
+    post_author_ids = np.asarray(data.post_author_ids)
+    post_indexes = np.asarray(data.post_indexes)
+    comment_author_ids = post_author_ids[post_indexes]
+    preceding = np.arange(data.number_of_comments) - np.asarray(data.comment_offsets)[post_indexes] + 1
+    dividers = np.where(np.asarray(data.user_ids) == comment_author_ids, np.sqrt(1 + preceding), 1.0)
+    weights = np.bincount(post_author_ids, minlength=len(data.users))*post_weight
+    weights += np.bincount(comment_author_ids, weights=comment_weight/dividers, minlength=len(data.users))
+    return {data.users[i]: v for i, v in enumerate(weights) if v > threshold}
+
+
+def traverse_comments_branch(affinity_mat, comment_to_comment_value, users_weights, users_idxes, data, user_name, user_idx, author_name, author_idx, current_row, current_depth):
+    parent_row = None
     current_depth += 1
     try:
-        parent = current_comment["parent"]
-        if parent != "0":
-            parent_comment = next(c for c in record["comments"] if (c["id"] == "comment_" + parent))
-            parent_name = parent_comment["user"]
-            parent_idx = users_names.index(parent_comment["user"])
+        parent = data.parent_indexes[current_row]
+        if parent == MISSING_PARENT:
+            return
+        if parent != ROOT_PARENT:
+            parent_row = parent
+            parent_name = data.comment_user(parent_row)
+            parent_idx = users_idxes[parent_name]
             if parent_idx == user_idx:
                 raise ValueError
         else:
@@ -88,12 +89,10 @@ def traverse_comments_branch(affinity_mat, comment_to_comment_value, users_weigh
             parent_idx = author_idx
         affinity_mat[parent_idx, user_idx] += comment_to_comment_value/sqrt(current_depth)*(1.0/users_weights[parent_name] + 1.0/users_weights[user_name])
         affinity_mat[user_idx, parent_idx] += comment_to_comment_value/sqrt(current_depth)*(1.0/users_weights[parent_name] + 1.0/users_weights[user_name])
-    except StopIteration:
+    except (ValueError, KeyError):
         pass
-    except ValueError:
-        pass
-    if parent_comment is not None:
-        traverse_comments_branch(affinity_mat, comment_to_comment_value, users_weights, users_names, record, user_name, user_idx, author_name, author_idx, parent_comment, current_depth)
+    if parent_row is not None:
+        traverse_comments_branch(affinity_mat, comment_to_comment_value, users_weights, users_idxes, data, user_name, user_idx, author_name, author_idx, parent_row, current_depth)
 
 
 @save_code_based_cache("politics_interuser_affinity_mat.pkl")
@@ -101,26 +100,25 @@ def compute_interuser_affinity(data, users_weights, users_names, comment_to_post
     print("Computing interuser affinity")
 
     affinity_mat = np.zeros(shape=(len(users_names), len(users_names)))
+    users_idxes = {user_name: idx for idx, user_name in enumerate(users_names)}
 
-    l = len(data.values())
+    l = data.number_of_posts
     all_commenters_idxes = set()
-    for i, record in enumerate(data.values()):
+    for i in range(l):
         print("Processing affinity for {}/{} post".format(i + 1, l))
-        try:
-            author_name = record["author"]
-            author_idx = users_names.index(author_name)
-        except ValueError:
+        author_name = data.post_author(i)
+        if author_name not in users_idxes:
             continue
-        for comment in record["comments"]:
-            try:
-                user_name = comment["user"]
-                user_idx = users_names.index(user_name)
-                affinity_mat[user_idx, author_idx] += comment_to_post_author_value*(1.0/users_weights[user_name] + 1.0/users_weights[author_name])
-                affinity_mat[author_idx, user_idx] += comment_to_post_author_value*(1.0/users_weights[user_name] + 1.0/users_weights[author_name])
-                all_commenters_idxes.add((user_idx, user_name))
-            except ValueError:
+        author_idx = users_idxes[author_name]
+        for row in data.post_comment_rows(i):
+            user_name = data.comment_user(row)
+            if user_name not in users_idxes:
                 continue
-            traverse_comments_branch(affinity_mat, comment_to_comment_value, users_weights, users_names, record, user_name, user_idx, author_name, author_idx, comment, 0)
+            user_idx = users_idxes[user_name]
+            affinity_mat[user_idx, author_idx] += comment_to_post_author_value*(1.0/users_weights[user_name] + 1.0/users_weights[author_name])
+            affinity_mat[author_idx, user_idx] += comment_to_post_author_value*(1.0/users_weights[user_name] + 1.0/users_weights[author_name])
+            all_commenters_idxes.add((user_idx, user_name))
+            traverse_comments_branch(affinity_mat, comment_to_comment_value, users_weights, users_idxes, data, user_name, user_idx, author_name, author_idx, row, 0)
     all_commenters_idxes = list(all_commenters_idxes)
     for i, (idx1, name1) in enumerate(all_commenters_idxes):
         for (idx2, name2) in all_commenters_idxes[:i+1]:
@@ -188,8 +186,7 @@ def intersection_analysis(users_names, labels_list, **kwargs):
 if __name__ == "__main__":
 
     print("Loading data")
-    with open("full_data.pkl", "rb") as handle:
-        data = pickle.load(handle)
+    data = open_comment_store()
 
     for name, params in compute_interuser_affinity_configs.items():
 
@@ -2,57 +2,89 @@ import warnings
 import numpy as np
 from drawing import draw_rating_violinplot, draw_rating_plot, draw_post_number_logplot
 from utils import timestamp_to_date, clean_folders, discretize
+from quantile_sketch import TDigest, merge_sketches
 import os
 
 
 RESULT_FOLDER = "rating_density"
 
 
-def _compute_gini_coefficient(X, nquants=250):
-    X = np.asarray(sorted(X))
-    csX = np.cumsum(X)
-    csX = csX / float(csX[-1])
-    n = len(X)
-    q = n//nquants
+def _compute_gini_coefficient(X):
+    """
+    Exact Gini index: one minus twice the area under the Lorenz curve of all values
+    """
+    X = np.sort(X)
+    lorenz = np.concatenate([[0], np.cumsum(X)/float(np.sum(X))])
+    return 1 - np.sum(lorenz[1:] + lorenz[:-1])/len(X)
 
-    cumarea = 0
-    for i in range(1, nquants):
-        cumarea += csX[i*q] + csX[(i-1)*q]
 
-    gini = 1 - (1.0/nquants)*cumarea
-    return gini
+def daily_rating_sketches(data, compression=1000):
+    """
+    :return: Dictionary {day number since epoch: TDigest of ratings of posts of that day}
+    """
+    idxes = data.posts_by_time()
+    days = data.timestamps[idxes] // (24*60*60)
+    ratings = data.ratings[idxes]
+    bounds = np.flatnonzero(np.diff(days)) + 1
+    starts = np.concatenate([[0], bounds]) if len(days) else []
+    return {int(days[start]): TDigest(compression).update(day_ratings)
+            for start, day_ratings in zip(starts, np.split(ratings, bounds))}
 
 
-def analyze_rating_density(data):
+def _check_sketch_against_exact(ratings, sketch, percentiles):
+    """
+    Warns if rank of any sketch percentile is further from exact one than documented bound
+    """
+    sorted_ratings = np.sort(ratings)
+    n = len(sorted_ratings)
+    for p in percentiles:
+        q = p/100.0
+        estimate = sketch.percentile(p)
+        lo = np.searchsorted(sorted_ratings, estimate, side="left")/n
+        hi = np.searchsorted(sorted_ratings, estimate, side="right")/n
+        rank_error = 0.0 if lo <= q <= hi else min(abs(lo - q), abs(hi - q))
+        print("Percentile {}: sketch {:.2f}, exact {:.2f}, rank error {:.6f} (bound {:.6f})".format(
+            p, estimate, np.percentile(sorted_ratings, p), rank_error, sketch.rank_error_bound(q)))
+        if rank_error > sketch.rank_error_bound(q) + 1.0/n:
+            warnings.warn("Sketch percentile {} is out of error bound".format(p), RuntimeWarning)
+    print("Gini index: sketch {:.4f}, exact {:.4f}".format(sketch.gini(), _compute_gini_coefficient(sorted_ratings)))
+
+
+def analyze_rating_density(data, check_exact=False):
 
     print("Analyze rating overall density")
     clean_folders([RESULT_FOLDER])
 
-    ratings = sorted([v["rating"] for v in data.values()], reverse=True)
+    sketch = merge_sketches(daily_rating_sketches(data).values())
+    if check_exact:
+        _check_sketch_against_exact(data.ratings, sketch, [50, 95, 99, 99.9])
+
+    # Only top posts are needed in order
+    ratings = np.asarray(data.ratings)
+    top_n = min(81, len(ratings))
+    top_ratings = -np.sort(-np.partition(ratings, len(ratings) - top_n)[len(ratings) - top_n:])
     names = []
     hlines = []
     idxes = list(range(8)) + [11, 15, 20, 30, 40, 60, 80]
     for i in idxes:
-        r = ratings[i]
-        try:
-            record = next(record for record in data.values() if record["rating"] == r)
-            hlines.append([0.61 + 0.285*(i%2), r, record["title"] + " (р:" + str(r) + ", " + timestamp_to_date(record["timestamp"]) + ")"])
-            names.append(record["title"])
-        except StopIteration as si:
+        r = top_ratings[i]
+        matching = np.flatnonzero(data.ratings == r)
+        if len(matching):
+            idx = matching[0]
+            hlines.append([0.61 + 0.285*(i%2), r, data.titles[idx] + " (р:" + str(r) + ", " + timestamp_to_date(data.timestamps[idx]) + ")"])
+            names.append(data.titles[idx])
+        else:
             warnings.warn("Could not find record with such rating: {}".format(r), RuntimeWarning)
 
-    gini = _compute_gini_coefficient(ratings)
-    p999 = np.percentile(ratings, 99.9)
-    p99 = np.percentile(ratings, 99)
-    p95 = np.percentile(ratings, 95)
-    mean = np.mean(ratings)
-    median = np.median(ratings)
+    gini = sketch.gini()
+    p95, p99, p999, median = sketch.percentile([95, 99, 99.9, 50])
+    mean = sketch.mean()
 
     hlines.append([1.0, p999, "99.9 перцентиль ({0:.2f})".format(p999)])
     hlines.append([1.0, p99, "99 перцентиль ({0:.2f})".format(p99)])
     hlines.append([1.0, p95, "95 перцентиль ({0:.2f})".format(p95)])
     hlines.append([0.61, 0.0, "Индекс Джини: {0:.4f}, среднее: {1:.2f}, медиана: {2:.2f}".format(gini, mean, median)])
-    scatter_top_posts = list(zip([1.0]*80, ratings[:80]))
+    scatter_top_posts = list(zip([1.0]*80, top_ratings[:80]))
     name = os.path.join(RESULT_FOLDER, "rating_violinplot.png")
     draw_rating_violinplot(ratings, hlines=hlines, scatter=scatter_top_posts, path_to_save=name)
     name = os.path.join(RESULT_FOLDER, "lores_rating_violinplot.png")
@@ -61,7 +93,7 @@ def analyze_rating_density(data):
                            scatter=scatter_top_posts[:25], path_to_save=name, figsize=(8, 10))
 
     n_bins_for_logplot = 100
-    N = discretize([r for r in ratings if 100 < r <= 10000], bins=n_bins_for_logplot, normalize=False)
+    N = discretize(ratings[(ratings > 100) & (ratings <= 10000)], bins=n_bins_for_logplot, normalize=False)
     name = os.path.join(RESULT_FOLDER, "logplot.png")
     draw_post_number_logplot([n_bins_for_logplot*i for i in range(len(N))],
                              [N],
@@ -1,6 +1,9 @@
 import numpy as np
-from performance.caching import simple_cache
-from utils import extract_rating_by_time, discretize, extract_sorted_rating_with_time, clean_folders, timestamp_to_date
+from storage.post_filters import TagAny
+from storage.tag_time_cube import TagTimeCube
+from smoothing import linear_smoother, gaussian_weights
+from peaks import top_peaks
+from utils import extract_sorted_rating_with_time, clean_folders, timestamp_to_date
 import warnings
 import os
 
@@ -8,53 +11,34 @@ from drawing import draw_rating_plot
 
 RESULT_FOLDER = "rating_plots"
 
-def _construct_linear_smoother(weights):
-    def linear_smoother(X):
-        S = []
-        lx = len(X)
-        lw = len(weights)
-        for i, x in enumerate(X):
-            s = 0
-            for j, w in zip(range(i - lw//2, i + lw//2), weights):
-                if j < 0:
-                    s += X[0]*w
-                elif j >= lx:
-                    s += X[lx-1]*w
-                else:
-                    s += X[j]*w
-            S.append(s)
-        return np.asarray(S)
-    return linear_smoother
-
 def _construct_default_linear_smoother():
-    return _construct_linear_smoother([0.05, 0.1, 0.2, 0.3, 0.2, 0.1, 0.05])
+    return linear_smoother([0.05, 0.1, 0.2, 0.3, 0.2, 0.1, 0.05])
 
 def _construct_strong_linear_smoother():
-    W = np.exp(-np.square(np.arange(-6, 7))/16) # Gaussian smoother
-    return _construct_linear_smoother(W/sum(W))
+    return linear_smoother(gaussian_weights(6, 8))
 
 
-@simple_cache("tag_time_rating.pkl")
 def _get_normalized_density(data, tag_groups, discretizing_divisor, begin_time, end_time):
-
-    def data_producer():
-        l = len(tag_groups)
-        for i, tag_group in enumerate(tag_groups):
-            if type(tag_group) is str:
-                tag_group = {tag_group}
-            print("{}/{} ({})".format(i+1, l, str(tag_group)))
-            try:
-                T, R = extract_rating_by_time(data, lambda v: any([tag in v["tags"] for tag in tag_group]))
-                yield T, R, tag_group
-            except RuntimeError as re:
-                warnings.warn("No such tags: {}".format(str(tag_group)), RuntimeWarning)
+    """
+    Densities are re-binned rows of tag x hour cube, which is cached per dataset version
+    """
+    cube = TagTimeCube.cached(data)
+    if begin_time is None:
+        begin_time = int(np.min(data.timestamps))
+    if end_time is None:
+        end_time = int(np.max(data.timestamps))
 
     def frequency_sorter_function(X):
         return np.max(X) - np.min(X)
 
     tag_time_rating = []
-    for T, R, tag_group in data_producer():
-        T = discretize(T, discretizing_divisor=discretizing_divisor, begin_x=begin_time, end_x=end_time, normalize=True)
+    for tag_group in tag_groups:
+        if type(tag_group) is str:
+            tag_group = {tag_group}
+        T = cube.normalized_density(tag_group, begin_time, end_time, discretizing_divisor)
+        if T is None:
+            warnings.warn("No such tags: {}".format(str(tag_group)), RuntimeWarning)
+            continue
         swing = frequency_sorter_function(T)
         tag_time_rating.append([swing, tag_group, T])
 
@@ -150,16 +134,25 @@ def analyze_density_by_tag_and_time(data, begin_time=None, end_time=None, tag_gr
         group, smoother, draw_precise_plots = config["group"], config["smoother"], config["draw_precise_plots"]
         plots, labels, captions_batches, vline_batches = [], [], [], []
 
-        T = None
+        found_tags, densities = [], []
         for tag in group:
             try:
                 record = next(record for record in tag_time_rating if (tag in record[1] or tag == record[1]))
-                normalized_density = smoother(record[2])
+                found_tags.append(tag)
+                densities.append(record[2])
+            except StopIteration as si:
+                warnings.warn("No such tag in tag_time_rating: {}".format(str(tag)), RuntimeWarning)
+        smoothed_densities = smoother(np.vstack(densities)) if densities else []
+        peak_batches = top_peaks(smoothed_densities, number_of_peaks) if draw_precise_plots and densities else [None]*len(found_tags)
+
+        T = None
+        for tag, normalized_density, peak_idxes in zip(found_tags, smoothed_densities, peak_batches):
+            try:
                 if T is None:
                     T = np.arange(len(normalized_density))*discretizing_divisor + begin_time
 
                 if draw_precise_plots:
-                    T2, R = extract_sorted_rating_with_time(data, lambda v: tag in v["tags"] or tag == record[1])
+                    T2, R = extract_sorted_rating_with_time(data, TagAny(tag))
                     current_vlines = [
                         [
                             T2[i],
@@ -172,13 +165,6 @@ def analyze_density_by_tag_and_time(data, begin_time=None, end_time=None, tag_gr
                         current_vlines[i][1] = max(normalized_density)*(number_of_precise_ratings-i)/(number_of_precise_ratings+1)
                     vline_batches.append(current_vlines)
 
-                    strong_maximums = []
-                    for i in range(1, len(normalized_density)):
-                        if normalized_density[i] > normalized_density[i-1] and normalized_density[i] > normalized_density[i+1]:
-                            strong_maximums.append(normalized_density[i])
-                    sorted_strong_maximums = sorted(strong_maximums, reverse=True)
-
-                    peak_idxes = [np.where(normalized_density==d)[0][0] for d in sorted_strong_maximums[:number_of_peaks]]
                     captions_batches.append([
                         (
                             T[max_idx],
@@ -192,8 +178,6 @@ def analyze_density_by_tag_and_time(data, begin_time=None, end_time=None, tag_gr
                     labels.append(tag)
                 else:
                     labels.append("+".join(tag))
-            except StopIteration as si:
-                warnings.warn("No such tag in tag_time_rating: {}".format(str(tag)), RuntimeWarning)
             except RuntimeError as re:
                 warnings.warn("No such tag in data: {}".format(str(tag)), RuntimeWarning)
 
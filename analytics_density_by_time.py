@@ -1,6 +1,6 @@
+from collections import namedtuple
 from enum import Enum
 import os
-import datetime
 from drawing import draw_rating_hourly, draw_rating_daily, draw_rating_monthly
 from utils import extract_rating_by_time, discretize, clean_folders
 import numpy as np
@@ -16,25 +16,44 @@ class _TimestampFormat(Enum):
     DAILY = 3,
     MONTHLY = 4
 
-def _roll_timestamps(timestamps, format):
+CalendarFields = namedtuple("CalendarFields", ["weekday", "day", "hour", "minute", "second"])
+
+
+def _decompose_timestamps(timestamps, utc_offset=0):
+    """
+    Stored timestamps are already shifted to Moscow time, so by default they are decomposed as UTC
+    :param utc_offset: Offset in seconds added to timestamps before decomposition
+    :return: CalendarFields of integer arrays: weekday (0 is Monday), day of month, hour, minute, second
+    """
+    moments = (np.asarray(timestamps, dtype=np.int64) + utc_offset).astype("datetime64[s]")
+    days = moments.astype("datetime64[D]")
+    seconds_of_day = (moments - days).astype(np.int64)
+    return CalendarFields(
+        weekday=(days.astype(np.int64) + 3) % 7, # 1970-01-01 was Thursday
+        day=(days - days.astype("datetime64[M]")).astype(np.int64) + 1,
+        hour=seconds_of_day // (60*60),
+        minute=seconds_of_day % (60*60) // 60,
+        second=seconds_of_day % 60)
+
+
+def _roll_timestamps(calendar, format):
+    """
+    :param calendar: CalendarFields of timestamps
+    :return: Rolled timestamps and boolean mask of timestamps they were made of
+    """
     if format not in [_TimestampFormat.DAILY, _TimestampFormat.HOURLY, _TimestampFormat.HOURLY_WEEKDAY, _TimestampFormat.MONTHLY]:
         raise RuntimeError("Invalid rolling format")
-    rolled_timestamps = []
-    for ts_numeric in timestamps:
-        ts = datetime.datetime.fromtimestamp(ts_numeric)
-        day_of_week = ts.weekday()
-        year, month, day, hour, minute, second = ts.strftime('%Y %m %d %H %M %S').split()
-        year, month, day, hour, minute, second = float(year), float(month), float(day), float(hour), float(minute), float(second)
-        if format == _TimestampFormat.HOURLY:
-            rolled_timestamps.append(60*60*hour + 60*minute + second)
-        elif format == _TimestampFormat.HOURLY_WEEKDAY:
-            if day_of_week in range(0, 5):
-                rolled_timestamps.append(60*60*hour + 60*minute + second)
-        elif format == _TimestampFormat.DAILY:
-            rolled_timestamps.append(24*60*60*day_of_week + 60*60*hour + 60*minute + second)
-        elif format == _TimestampFormat.MONTHLY:
-            rolled_timestamps.append(24*60*60*(day-1) + 60*60*hour + 60*minute + second)
-    return np.asarray(rolled_timestamps)
+    time_of_day = 60*60*calendar.hour + 60*calendar.minute + calendar.second
+    mask = np.ones(len(time_of_day), dtype=bool)
+    if format == _TimestampFormat.HOURLY:
+        return time_of_day, mask
+    elif format == _TimestampFormat.HOURLY_WEEKDAY:
+        mask = calendar.weekday < 5
+        return time_of_day[mask], mask
+    elif format == _TimestampFormat.DAILY:
+        return 24*60*60*calendar.weekday + time_of_day, mask
+    elif format == _TimestampFormat.MONTHLY:
+        return 24*60*60*(calendar.day-1) + time_of_day, mask
 
 
 def analyze_density_by_time(data):
@@ -42,11 +61,12 @@ def analyze_density_by_time(data):
     print("Analyze density by time")
     clean_folders([RESULT_FOLDER])
 
-    T, R = extract_rating_by_time(data, lambda x: True)
+    T, R = extract_rating_by_time(data)
+    calendar = _decompose_timestamps(T)
 
     print("Analyze density by time: hourly for weekdays")
-    rolled_timestamps = _roll_timestamps(T, _TimestampFormat.HOURLY_WEEKDAY)
-    N_rolled, R_rolled = discretize(X=rolled_timestamps, Y=R, bins=2*24, normalize=False)
+    rolled_timestamps, mask = _roll_timestamps(calendar, _TimestampFormat.HOURLY_WEEKDAY)
+    N_rolled, R_rolled = discretize(X=rolled_timestamps, Y=R[mask], bins=2*24, normalize=False)
     corresponding_time_ticks = np.arange(0, 24*60*60, 30*60)
     path_to_save = os.path.join(RESULT_FOLDER, "hourly_weekday")
     draw_rating_hourly(corresponding_time_ticks, R_rolled, N_rolled, path_to_save=path_to_save)
@@ -54,8 +74,8 @@ def analyze_density_by_time(data):
     draw_rating_hourly(corresponding_time_ticks, R_rolled, N_rolled, path_to_save=path_to_save, figsize=(12, 6))
 
     print("Analyze density by time: daily for weeks")
-    rolled_timestamps = _roll_timestamps(T, _TimestampFormat.DAILY)
-    N_rolled, R_rolled = discretize(X=rolled_timestamps, Y=R, bins=7*24, normalize=False)
+    rolled_timestamps, mask = _roll_timestamps(calendar, _TimestampFormat.DAILY)
+    N_rolled, R_rolled = discretize(X=rolled_timestamps, Y=R[mask], bins=7*24, normalize=False)
     corresponding_time_ticks = np.arange(0, 7*24*60*60, 60*60)
     path_to_save = os.path.join(RESULT_FOLDER, "daily")
     draw_rating_daily(corresponding_time_ticks, R_rolled, N_rolled, path_to_save=path_to_save)
@@ -63,8 +83,8 @@ def analyze_density_by_time(data):
     draw_rating_daily(corresponding_time_ticks, R_rolled, N_rolled, path_to_save=path_to_save, figsize=(12, 6))
 
     print("Analyze density by time: monthly")
-    rolled_timestamps = _roll_timestamps(T, _TimestampFormat.MONTHLY)
-    N_rolled, R_rolled = discretize(X=rolled_timestamps, Y=R, bins=30*12, normalize=False)
+    rolled_timestamps, mask = _roll_timestamps(calendar, _TimestampFormat.MONTHLY)
+    N_rolled, R_rolled = discretize(X=rolled_timestamps, Y=R[mask], bins=30*12, normalize=False)
     corresponding_time_ticks = np.arange(0, 30*24*60*60, 2*60*60)
     path_to_save = os.path.join(RESULT_FOLDER, "monthly")
     draw_rating_monthly(corresponding_time_ticks, R_rolled, N_rolled, path_to_save=path_to_save)
@@ -1,8 +1,6 @@
 import os
-import numpy as np
-from performance.caching import simple_cache
 from drawing import draw_rating_bar_chart
-from utils import clean_folders, filter_tags_by_occurency_number
+from utils import clean_folders, filter_tags_by_occurency_number, segment_statistics
 
 RESULT_FOLDER = "tag_wise_mean_rating"
 
@@ -11,22 +9,28 @@ def analyze_tag_wise_mean_rating(data, tags=None):
 
     clean_folders([RESULT_FOLDER])
     if tags is None:
-        tags = filter_tags_by_occurency_number(data, tag_occurencies_filter=lambda v: v >= 200, save_code=413)
+        tags = filter_tags_by_occurency_number(data, min_occurencies=200)
 
-    mean_tag_wise_rating = compute_tag_wise_mean_rating(data, tags)
+    statistics = compute_tag_wise_rating_statistics(data, tags)
+    mean_tag_wise_rating = {tag: tag_statistics["mean"] for tag, tag_statistics in statistics.items()}
+    confidence_intervals = {tag: tag_statistics["ci95"] for tag, tag_statistics in statistics.items()}
     path_to_save = os.path.join(RESULT_FOLDER, "tag_wise_mean_rating_barchart.png")
-    draw_rating_bar_chart(mean_tag_wise_rating, path_to_save=path_to_save)
+    draw_rating_bar_chart(mean_tag_wise_rating, path_to_save=path_to_save, confidence_intervals=confidence_intervals)
     path_to_save = os.path.join(RESULT_FOLDER, "lores_tag_wise_mean_rating_barchart.png")
-    draw_rating_bar_chart(mean_tag_wise_rating, path_to_save=path_to_save, bars_threshold=24, figsize=(12, 9))
+    draw_rating_bar_chart(mean_tag_wise_rating, path_to_save=path_to_save, bars_threshold=24, figsize=(12, 9),
+                          confidence_intervals=confidence_intervals)
+
+
+def compute_tag_wise_rating_statistics(data, tags, percentiles=(5, 25, 75, 95)):
+    """
+    Ratings of posts are grouped by tag in one pass over incidence matrix of tags, cheap enough to need no cache
+    :return: Dictionary {tag: {statistic: value}} with statistics of utils.segment_statistics
+    """
+    print("Computing tag wise rating statistics")
+    X = data.tag_incidence(tags)
+    statistics = segment_statistics(data.ratings[X.indices], X.indptr, percentiles)
+    return {tag: {name: values[i] for name, values in statistics.items()} for i, tag in enumerate(tags)}
 
 
-@simple_cache("tag_wise_mean_rating.pkl")
 def compute_tag_wise_mean_rating(data, tags):
-    print("Computing mean tag wise rating")
-    result = {}
-    number_of_tags = len(tags)
-    for i, tag in enumerate(tags):
-        if not (i + 1)%50:
-            print("{}/{}".format(i + 1, number_of_tags))
-        result[tag] = np.mean([d["rating"] for d in data.values() if tag in d["tags"]])
-    return result
\ No newline at end of file
+    return {tag: tag_statistics["mean"] for tag, tag_statistics in compute_tag_wise_rating_statistics(data, tags).items()}
\ No newline at end of file
@@ -1,45 +1,84 @@
+import multiprocessing
 import os
 import numpy as np
+from scipy import sparse
 from performance.caching import save_code_based_cache
 from drawing import draw_heat_square_matrix
 from utils import clean_folders, filter_tags_by_occurency_number
 
 RESULT_FOLDER = "tags_correlation"
 
+def _chisquare_distance(data, tags):
+    """
+    Chi-square statistic of 2x2 contingency table for every pair of tags. With X being post x tag
+    incidence matrix, d (posts with both tags) is X^T*X, the rest of the table follows from tag counts
+    """
+    X = data.tag_incidence(tags)
+    d = (X.T @ X).toarray().astype(np.float64)
+    n = np.diag(d).copy() # posts with the tag
+    N = float(len(data))
+    b = n[None, :] - d
+    c = n[:, None] - d
+    a = N - b - c - d
+    with np.errstate(divide="ignore", invalid="ignore"):
+        chi = N*np.square(a*d - b*c)/((a + b)*(a + c)*(b + d)*(c + d))
+    chi[~np.isfinite(chi)] = 0 # tag found in no posts or in every post
+    np.fill_diagonal(chi, 0)
+    return chi
+
+
+def _tag_count_matrix(data, tags):
+    """
+    :return: Sparse post x tag matrix (scipy CSR) of numbers of occurrences of tags[j] in post i
+    """
+    tag_columns = {tag: column for column, tag in enumerate(tags)}
+    column_of_tag_id = np.full(len(data.tags), -1, dtype=np.int64)
+    for tag_id, tag in enumerate(data.tags):
+        column_of_tag_id[tag_id] = tag_columns.get(tag, -1)
+    columns = column_of_tag_id[data.tag_ids]
+    selected = columns >= 0
+    rows = data.tag_post_indexes()[selected]
+    # Duplicate entries are summed, so tag repeated within a post is counted as many times as it occurs
+    return sparse.csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, columns[selected])), shape=(len(data), len(tags)))
+
+
+_count_matrix = None
+
+
+def _init_cooccurrence_worker(count_matrix):
+    global _count_matrix
+    _count_matrix = count_matrix
+
+
+def _cooccurrence_block(columns):
+    begin, end = columns
+    return (_count_matrix[:, begin:end].T @ _count_matrix).tocsr()
+
+
+def _cooccurrence_matrix(data, tags, block_size=2048, processes=None):
+    """
+    Number of times every pair of tags occurs together, summed over posts. Tags occurring in one post
+    x and y times add x*y. For vocabularies larger than block_size rows are computed by blocks in a process pool
+    :return: Sparse tag x tag matrix (scipy CSR)
+    """
+    X = _tag_count_matrix(data, tags).tocsc()
+    if len(tags) <= block_size:
+        return (X.T @ X).tocsr()
+    blocks = [(begin, min(begin + block_size, len(tags))) for begin in range(0, len(tags), block_size)]
+    with multiprocessing.Pool(processes, initializer=_init_cooccurrence_worker, initargs=(X,)) as pool:
+        return sparse.vstack(pool.map(_cooccurrence_block, blocks), format="csr")
+
+
 @save_code_based_cache("tags_distance.pkl")
 def _compute_tags_distance(data, tags, method, **kwargs):
-    l = len(tags)
-    distance_mat = np.zeros(shape=(l, l))
-
+    """
+    :return: Dense chi-square distance matrix for "chisquare" method,
+    sparse negated co-occurrence matrix otherwise, and tags
+    """
     if method == "chisquare":
-        for idx1, tag1 in enumerate(tags):
-            print("Computing distance {}/{}".format(idx1 + 1, len(tags)))
-            for idx2, tag2 in enumerate(tags[idx1+1:]):
-                a, b, c, d = 0, 0, 0, 0
-                for post in data.values():
-                    tag1in, tag2in = tag1 in post["tags"], tag2 in post["tags"]
-                    if not tag1in and not tag2in:
-                        a += 1
-                    elif not tag1in and tag2in:
-                        b += 1
-                    elif tag1in and not tag2in:
-                        c += 1
-                    else:
-                        d += 1
-                chi = (a + b + c + d)*(a*d - b*c)*(a*d - b*c)/((a + b)*(a + c)*(b + d)*(c + d))
-                distance_mat[idx1, idx2 + idx1 + 1] = chi
-                distance_mat[idx2 + idx1 + 1, idx1] = chi
+        distance_mat = _chisquare_distance(data, tags)
     else:
-        for post in data.values():
-            for i, tag1 in enumerate(post["tags"]):
-                if tag1 in tags:
-                    idx1 = tags.index(tag1)
-                    distance_mat[idx1, idx1] -= 1
-                    for tag2 in post["tags"][i+1:]:
-                        if tag2 in tags:
-                            idx2 = tags.index(tag2)
-                            distance_mat[idx1, idx2] -= 1
-                            distance_mat[idx2, idx1] -= 1
+        distance_mat = -_cooccurrence_matrix(data, tags)
 
     return distance_mat, tags
 
@@ -55,9 +94,9 @@ def analyze_tags_correlation(data, tags=None):
     print("Analyzing tags correlation")
     clean_folders([RESULT_FOLDER])
     if tags is None:
-        tags = filter_tags_by_occurency_number(data, tag_occurencies_filter=lambda v: v >= 3500, save_code=612)
+        tags = filter_tags_by_occurency_number(data, min_occurencies=3500)
         _analyze_tags_correlation_subtask(data, tags, "tags_correlation_heatmat.png", figsize=(14, 14), save_code=612)
-        tags = filter_tags_by_occurency_number(data, tag_occurencies_filter=lambda v: v >= 5000, save_code=111)
+        tags = filter_tags_by_occurency_number(data, min_occurencies=5000)
         _analyze_tags_correlation_subtask(data, tags, "lores_tags_correlation_heatmat.png", figsize=(9, 9), save_code=111)
     else:
         _analyze_tags_correlation_subtask(data, tags, "tags_correlation_heatmat.png",(14, 14), save_code=0)
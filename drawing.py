@@ -105,9 +105,12 @@ def draw_heat_square_matrix(matrix, labels, **kwargs):
     fig.subplots_adjust(top=0.85, left=0.15)
 
 
-@enforce_kwargs({"path_to_save", "should_save", "hlines", "vlines", "captions", "figsize", "bars_threshold"})
+@enforce_kwargs({"path_to_save", "should_save", "hlines", "vlines", "captions", "figsize", "bars_threshold", "confidence_intervals"})
 @savable(default_save=True, default_path_to_save="rating_bar_chart.png")
 def draw_rating_bar_chart(data_dictionary, bars_threshold=60, **kwargs):
+    """
+    :param confidence_intervals: Optional dictionary {tag: half-width of confidence interval} drawn as error bars
+    """
 
     hlines = []
     if len(data_dictionary) < bars_threshold:
@@ -132,7 +135,9 @@ def draw_rating_bar_chart(data_dictionary, bars_threshold=60, **kwargs):
 
     fig = plt.figure(figsize=kwargs["figsize"] if "figsize" in kwargs else (44, 12))
     ax = plt.subplot(111)
-    rects1 = ax.bar(ind, y, width, color='b')
+    confidence_intervals = kwargs.get("confidence_intervals")
+    yerr = [confidence_intervals[tag] for tag in tags] if confidence_intervals is not None else None
+    rects1 = ax.bar(ind, y, width, color='b', yerr=yerr, ecolor='k', capsize=2)
 
     if hlines:
         for x, y, text in hlines:
@@ -0,0 +1,68 @@
+import numpy as np
+from scipy import signal
+
+
+def local_maxima(X):
+    """
+    :param X: 2-D batch of series, one per row
+    :return: Row and column indexes of points strictly greater than both neighbours,
+    first and last points of series are never maxima
+    """
+    X = np.asarray(X)
+    inner = X[:, 1:-1]
+    rows, columns = np.nonzero((inner > X[:, :-2]) & (inner > X[:, 2:]))
+    return rows, columns + 1
+
+
+def _highest(heights, number_of_peaks):
+    """
+    :return: Positions of 'number_of_peaks' greatest heights ordered by decreasing height, ties by position
+    """
+    if number_of_peaks is not None and number_of_peaks < len(heights):
+        selected = np.sort(np.argpartition(-heights, number_of_peaks - 1)[:number_of_peaks])
+    else:
+        selected = np.arange(len(heights))
+    return selected[np.argsort(-heights[selected], kind="stable")]
+
+
+def _select_by_distance(peaks, heights, min_distance, number_of_peaks, length):
+    """
+    Greedily keeps highest peaks, dropping ones closer than 'min_distance' to already kept
+    """
+    blocked = np.zeros(length, dtype=bool)
+    kept = []
+    for peak in peaks[np.argsort(-heights, kind="stable")]:
+        if not blocked[peak]:
+            kept.append(peak)
+            blocked[max(peak - min_distance + 1, 0):peak + min_distance] = True
+            if number_of_peaks is not None and len(kept) == number_of_peaks:
+                break
+    return np.asarray(kept, dtype=np.intp)
+
+
+def top_peaks(X, number_of_peaks=None, min_prominence=None, min_distance=None):
+    """
+    Finds peaks of every series of a batch
+    :param X: Series or 2-D batch of them (one per row)
+    :param number_of_peaks: How many highest peaks to keep, None for all
+    :param min_prominence: Peaks rising less than this above the higher of their bases are dropped
+    :param min_distance: Of peaks closer than this number of points only the higher one is kept
+    :return: Peak indexes ordered by decreasing height; list of them for each row of batch
+    """
+    X = np.asarray(X)
+    if X.ndim == 1:
+        return top_peaks(X[np.newaxis], number_of_peaks, min_prominence, min_distance)[0]
+    rows, columns = local_maxima(X)
+    bounds = np.searchsorted(rows, np.arange(len(X) + 1))
+    result = []
+    for row, (begin, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        peaks = columns[begin:end]
+        if min_prominence is not None and len(peaks):
+            prominences = signal.peak_prominences(X[row], peaks)[0]
+            peaks = peaks[prominences >= min_prominence]
+        heights = X[row, peaks]
+        if min_distance is not None and min_distance > 1:
+            result.append(_select_by_distance(peaks, heights, min_distance, number_of_peaks, X.shape[1]))
+        else:
+            result.append(peaks[_highest(heights, number_of_peaks)])
+    return result
@@ -0,0 +1,136 @@
+import argparse
+import json
+import os
+import time
+
+from scrapy.http import HtmlResponse
+
+from scraping.parsers import ParserBackend, PARSERS
+from storage.response_archive import ResponseArchive, RESPONSE_ARCHIVE_FOLDER
+
+
+def load_fixtures(folder):
+    """
+    Fixtures are saved pages: 'precise_*.html' are precise post pages, other '*.html' are listing pages.
+    They are not shipped, save some pages into a folder first or use load_archive
+    :return: Lists of (body, encoding) of listing and precise pages
+    """
+    if not os.path.isdir(folder):
+        raise RuntimeError("Fixtures folder {} does not exist, save some listing and precise pages into it".format(folder))
+    listings, precise = [], []
+    for file in sorted(os.listdir(folder)):
+        if not file.endswith(".html"):
+            continue
+        with open(os.path.join(folder, file), "rb") as handle:
+            body = handle.read()
+        (precise if file.startswith("precise") else listings).append((body, "utf-8"))
+    if not listings and not precise:
+        raise RuntimeError("No .html fixtures in {}".format(folder))
+    return listings, precise
+
+
+def load_archive(folder=RESPONSE_ARCHIVE_FOLDER, limit=None):
+    """
+    Takes real crawled pages from response archive by the callback they were downloaded for
+    :param limit: At most this many pages of each kind, None for all
+    :return: Lists of (body, encoding) of listing and precise pages
+    """
+    if not os.path.isdir(folder):
+        raise RuntimeError("Response archive {} does not exist, crawl with archiving enabled first".format(folder))
+    archive = ResponseArchive(folder)
+    pages = {"parse" : [], "parse_precise" : []}
+    for entry in archive.entries():
+        kind = pages.get(entry["callback"])
+        if kind is not None and (limit is None or len(kind) < limit):
+            kind.append((archive.load_body(entry["sha1"]), entry["encoding"]))
+    if not pages["parse"] and not pages["parse_precise"]:
+        raise RuntimeError("No archived listing or precise pages in {}".format(folder))
+    return pages["parse"], pages["parse_precise"]
+
+
+def _make_response(page):
+    body, encoding = page
+    return HtmlResponse(url="http://pikabu.ru/", body=body, encoding=encoding)
+
+
+def _outcome(parse, page):
+    """
+    :return: Parsed data, or type of exception for pages the parser rejects
+    """
+    try:
+        return parse(_make_response(page))
+    except Exception as e:
+        return type(e)
+
+
+def check_parsers_agree(listings, precise):
+    """
+    Parsers must return the same data and fail with the same exception on every page
+    :return: Listing and precise pages both parsers accept
+    """
+    reference, compiled = PARSERS[ParserBackend.SELECTORS](), PARSERS[ParserBackend.COMPILED]()
+    accepted = []
+    for pages, kind, method in [(listings, "listing", "parse_listing"), (precise, "precise", "parse_precise")]:
+        accepted.append([])
+        for i, page in enumerate(pages):
+            if reference.is_empty_page(_make_response(page)) != compiled.is_empty_page(_make_response(page)):
+                raise RuntimeError("Parsers disagree on emptiness of {} page #{}".format(kind, i))
+            expected = _outcome(getattr(reference, method), page)
+            if expected != _outcome(getattr(compiled, method), page):
+                raise RuntimeError("Parsers disagree on {} page #{}".format(kind, i))
+            if not isinstance(expected, type):
+                accepted[-1].append(page)
+    return accepted
+
+
+def benchmark_parser(parser, listings, precise, repeat=5):
+    """
+    Response construction (html parsing by lxml) is included into timings, as it is in the crawl
+    """
+    stories, comments = 0, 0
+    begin = time.perf_counter()
+    for _ in range(repeat):
+        for body in listings:
+            stories += len(parser.parse_listing(_make_response(body)))
+    listing_time = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    for _ in range(repeat):
+        for body in precise:
+            comments += len(parser.parse_precise(_make_response(body))[1]["comments"])
+    precise_time = time.perf_counter() - begin
+
+    return {
+        "stories" : stories,
+        "stories_per_second" : stories/listing_time if listing_time > 0 else 0.0,
+        "comments" : comments,
+        "comments_per_second" : comments/precise_time if precise_time > 0 else 0.0,
+    }
+
+
+def run_benchmark(listings, precise, repeat=5):
+    listings, precise = check_parsers_agree(listings, precise)
+    return {backend.name: benchmark_parser(parser(), listings, precise, repeat) for backend, parser in PARSERS.items()}
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Offline parse throughput benchmark on saved html pages")
+    arg_parser.add_argument("folder", nargs="?", help="Folder of saved pages: precise_*.html are post pages, other *.html are listings")
+    arg_parser.add_argument("--archive", default=None, help="Take pages from this response archive instead of a folder")
+    arg_parser.add_argument("--limit", type=int, default=None, help="At most this many archived pages of each kind")
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--output", default=None, help="Also write report to this json file")
+    args = arg_parser.parse_args()
+    if (args.folder is None) == (args.archive is None):
+        arg_parser.error("give either a folder of saved pages or --archive")
+
+    if args.archive is not None:
+        listings, precise = load_archive(args.archive, args.limit)
+    else:
+        listings, precise = load_fixtures(args.folder)
+    report = run_benchmark(listings, precise, args.repeat)
+    for backend, result in report.items():
+        print("{}: {:.1f} stories/s, {:.1f} comments/s".format(backend, result["stories_per_second"], result["comments_per_second"]))
+    if args.output is not None:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=4)
@@ -0,0 +1,135 @@
+import numpy as np
+
+
+class TDigest:
+    """
+    Mergeable quantile and Lorenz curve sketch (merging t-digest with arcsine scale function).
+    Values are kept as at most ~compression/2 centroids (mean, weight) ordered by mean; clusters are
+    small near the tails and large near the median, so extreme quantiles stay accurate.
+
+    Error bound: every centroid spans at most one unit of k(q) = compression/(2*pi)*asin(2q - 1), i.e.
+    q-width of pi*sqrt(q(1-q))*2/compression around q. Quantile q is interpolated between neighbouring
+    centroids, so rank of the returned value differs from q*N by at most rank_error_bound(q)*N
+    (plus one value for discrete data). Gini index is computed from the Lorenz curve of centroids,
+    ignoring inequality within a centroid, so it can only be underestimated, by at most
+    the sum of w_i/W * (centroid value range)*w_i/(total sum).
+    """
+
+    def __init__(self, compression=1000):
+        self.compression = compression
+        self.means = np.zeros(0)
+        self.weights = np.zeros(0)
+        self.min = np.inf
+        self.max = -np.inf
+
+    @property
+    def count(self):
+        return float(np.sum(self.weights))
+
+    def rank_error_bound(self, q):
+        return 2*np.pi*np.sqrt(q*(1 - q))/self.compression
+
+    def _k(self, q):
+        return self.compression/(2*np.pi)*np.arcsin(2*np.clip(q, 0, 1) - 1)
+
+    def update(self, values):
+        """
+        Adds batch of values (for example ratings of one scraped day)
+        """
+        values = np.sort(np.asarray(values, dtype=np.float64))
+        if not len(values):
+            return self
+        self.min = min(self.min, values[0])
+        self.max = max(self.max, values[-1])
+        # Single values form clusters by unit intervals of k of their left edge
+        cluster_ids = np.floor(self._k(np.arange(len(values))/len(values))).astype(np.int64)
+        cluster_ids -= cluster_ids[0]
+        weights = np.bincount(cluster_ids).astype(np.float64)
+        means = np.bincount(cluster_ids, weights=values)[weights > 0]/weights[weights > 0]
+        if self.count:
+            self._merge_centroids(means, weights[weights > 0])
+        else:
+            self.means, self.weights = means, weights[weights > 0]
+        return self
+
+    def merge(self, other):
+        """
+        Merges other digest into this one, e.g. digests of different days or shards
+        """
+        if other.count:
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            self._merge_centroids(other.means, other.weights)
+        return self
+
+    def _merge_centroids(self, means, weights):
+        means = np.concatenate([self.means, means])
+        weights = np.concatenate([self.weights, weights])
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+        # k of the right edge of every centroid; a cluster grows while its right edge is within
+        # one unit of k from its left edge, and always takes at least one centroid
+        cumulative = np.cumsum(weights)
+        k_right = self._k(cumulative/cumulative[-1])
+        starts = []
+        start, k_left = 0, -self.compression/4
+        while start < len(means):
+            starts.append(start)
+            start = max(int(np.searchsorted(k_right, k_left + 1, side="right")), start + 1)
+            k_left = k_right[start - 1]
+        # One iteration per output centroid, at most ~compression/2 of them whatever the input size
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means*weights, starts)/self.weights
+
+    def quantile(self, q):
+        """
+        :param q: Quantile in [0, 1] or array of them
+        """
+        if not self.count:
+            raise RuntimeError("Quantile of empty sketch")
+        total = self.count
+        centers = np.cumsum(self.weights) - self.weights/2
+        return np.interp(np.asarray(q)*total, np.concatenate([[0], centers, [total]]),
+                         np.concatenate([[self.min], self.means, [self.max]]))
+
+    def percentile(self, p):
+        return self.quantile(np.asarray(p)/100.0)
+
+    def mean(self):
+        return float(np.sum(self.means*self.weights)/self.count)
+
+    def lorenz_curve(self):
+        """
+        :return: Cumulative shares of values and of their sum at centroid boundaries, both starting from 0
+        """
+        population = np.concatenate([[0], np.cumsum(self.weights)])/self.count
+        cumulative_sum = np.concatenate([[0], np.cumsum(self.means*self.weights)])
+        return population, cumulative_sum/cumulative_sum[-1]
+
+    def gini(self):
+        population, lorenz = self.lorenz_curve()
+        return float(1 - np.sum(np.diff(population)*(lorenz[1:] + lorenz[:-1])))
+
+
+def merge_sketches(sketches, compression=1000, buffer_size=None):
+    """
+    Folds digests (of days or shards) into one, compressing whenever buffered centroids reach
+    'buffer_size' (by default 20 compressions), so memory does not grow with the number of digests
+    """
+    buffer_size = 20*compression if buffer_size is None else buffer_size
+    result = TDigest(compression)
+    buffered_means, buffered_weights, buffered = [], [], 0
+    for sketch in sketches:
+        if not sketch.count:
+            continue
+        result.min = min(result.min, sketch.min)
+        result.max = max(result.max, sketch.max)
+        buffered_means.append(sketch.means)
+        buffered_weights.append(sketch.weights)
+        buffered += len(sketch.means)
+        if buffered >= buffer_size:
+            result._merge_centroids(np.concatenate(buffered_means), np.concatenate(buffered_weights))
+            buffered_means, buffered_weights, buffered = [], [], 0
+    if buffered:
+        result._merge_centroids(np.concatenate(buffered_means), np.concatenate(buffered_weights))
+    return result
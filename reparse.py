@@ -0,0 +1,88 @@
+import argparse
+import asyncio
+import inspect
+import multiprocessing
+import os
+import shutil
+import traceback
+import warnings
+
+import scrapy
+from scrapy.http import HtmlResponse
+
+from scraper import PikabuSpider, build_datasets
+from scraping.pipelines import ShardWriterPipeline, DAY_CRAWLED_ITEM
+from storage.response_archive import ResponseArchive, RESPONSE_ARCHIVE_FOLDER
+
+
+REPARSE_SHARDS_FOLDER = "reparse_shards"
+
+_spider = None
+_archive = None
+_loop = None
+
+
+def _init_worker(archive_folder):
+    global _spider, _archive, _loop
+    PikabuSpider.crawl_state_file = None # replay must not touch crawl checkpoints
+    PikabuSpider.seen_posts_file = None
+    PikabuSpider.incremental = False
+    PikabuSpider.precise_parse_processes = None # already in a worker
+    _spider = PikabuSpider()
+    _archive = ResponseArchive(archive_folder)
+    _loop = asyncio.new_event_loop()
+
+
+def _callback_output(output):
+    """
+    Collects output of spider callback, which is a generator or an async generator (parse_precise)
+    """
+    if inspect.isasyncgen(output):
+        async def collect():
+            return [result async for result in output]
+        return _loop.run_until_complete(collect())
+    return list(output or [])
+
+
+def _reparse_entry(entry):
+    """
+    Replays archived response through the spider callback it was downloaded for
+    :return: List of items produced
+    """
+    try:
+        body = _archive.load_body(entry["sha1"])
+        request = scrapy.Request(entry["url"], meta=entry["meta"])
+        response = HtmlResponse(url=entry["url"], body=body, encoding=entry["encoding"], request=request)
+        return [result for result in _callback_output(getattr(_spider, entry["callback"])(response)) if isinstance(result, dict)]
+    except Exception:
+        warnings.warn("Could not reparse {}:\n{}".format(entry["url"], traceback.format_exc()), RuntimeWarning)
+        return []
+
+
+def reparse(archive_folder=RESPONSE_ARCHIVE_FOLDER, shards_folder=REPARSE_SHARDS_FOLDER, processes=None, chunksize=16):
+    """
+    Rebuilds columnar stores from archived responses without network access
+    """
+    if os.path.exists(shards_folder):
+        shutil.rmtree(shards_folder)
+    archive = ResponseArchive(archive_folder)
+    pipeline = ShardWriterPipeline()
+    pipeline.open(shards_folder)
+    with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(archive_folder,)) as pool:
+        # imap keeps archive order, so later responses of the same post override earlier ones as in crawl
+        for items in pool.imap(_reparse_entry, archive.entries(), chunksize):
+            for item in items:
+                if item["kind"] != DAY_CRAWLED_ITEM: # archive does not know when the day was crawled
+                    pipeline.process_item(item)
+    print("{} duplicate stories skipped".format(pipeline.close()))
+    build_datasets(shards_folder, PikabuSpider.should_extract_comments_data)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Reparse archived responses into datasets")
+    arg_parser.add_argument("archive", nargs="?", default=RESPONSE_ARCHIVE_FOLDER)
+    arg_parser.add_argument("--shards", default=REPARSE_SHARDS_FOLDER)
+    arg_parser.add_argument("--processes", type=int, default=None)
+    args = arg_parser.parse_args()
+
+    reparse(args.archive, args.shards, args.processes)
@@ -1,9 +1,19 @@
 from enum import Enum
 import scrapy
-import pickle
 from calendar import monthrange
 import datetime
 from scrapy.crawler import CrawlerProcess
+from scrapy.utils.defer import maybe_deferred_to_future
+from storage.post_store import PostStore
+from storage.comment_store import CommentStore
+from storage.shards import iterate_shard_records, read_crawled_days, SHARDS_FOLDER, POSTS_KIND, FULL_KIND
+from scraping.pipelines import STORY_ITEM, PRECISE_ITEM, DAY_CRAWLED_ITEM
+from scraping.crawl_state import CrawlState, CRAWL_STATE_FILE
+from scraping.parsers import ParserBackend, PARSERS
+from scraping.seen_posts import SeenPostIndex, SEEN_POSTS_FILE
+from scraping.crawl_stats import CRAWL_STATS_FILE, PARSE_TIME_META
+from scraping.parse_pool import ParsePool
+from storage.response_archive import RESPONSE_ARCHIVE_FOLDER
 
 
 def search_day(date):
@@ -16,6 +26,22 @@ def daterange(start_date, end_date):
     for n in range(int ((end_date - start_date).days)):
         yield start_date + datetime.timedelta(n)
 
+
+def build_datasets(shards_folder, should_extract_comments_data):
+    """
+    Streams shards into columnar post and comment stores, holding one day of records at a time
+    """
+    # Stories are already deduplicated and shifted to Moscow time by ShardWriterPipeline
+    print("Writing columnar post store")
+    PostStore.from_records(iterate_shard_records(shards_folder, POSTS_KIND)).save()
+
+    if should_extract_comments_data:
+        print("Writing comment store")
+        CommentStore.write(iterate_shard_records(shards_folder, FULL_KIND))
+
+    print("DONE")
+
+
 class ParseMethod(Enum):
     GENERAL=1
     POLITICS=2
@@ -29,6 +55,42 @@ class PikabuSpider(scrapy.Spider):
     page_max_number = 15
     should_extract_comments_data = True
     parse_method = ParseMethod.GENERAL
+    shards_folder = SHARDS_FOLDER
+    crawl_state_file = CRAWL_STATE_FILE
+    should_resume = True
+    # Incremental mode schedules only days missing from shards and days which were crawled
+    # or still are within 'settling_days' (their ratings keep changing)
+    incremental = False
+    settling_days = 3
+    parser_backend = ParserBackend.COMPILED
+    # With a number of processes precise pages are parsed in a process pool instead of reactor thread
+    precise_parse_processes = None
+    # Archived responses can be reparsed offline with reparse.py
+    should_archive_responses = False
+    response_archive_folder = RESPONSE_ARCHIVE_FOLDER
+    # Precise page of a post is fetched once, or once per 'precise_refresh_days' if it is not None
+    seen_posts_file = SEEN_POSTS_FILE
+    precise_refresh_days = None
+    # Throughput report is dumped every 'crawl_stats_interval' seconds. With 'target_latency' (seconds)
+    # not None concurrency is tuned to keep download latency below it
+    crawl_stats_file = CRAWL_STATS_FILE
+    crawl_stats_interval = 60
+    target_latency = None
+
+    custom_settings = {
+        "ITEM_PIPELINES" : {
+            "scraping.pipelines.ShardWriterPipeline" : 300,
+        },
+        "DOWNLOADER_MIDDLEWARES" : {
+            "scraping.middlewares.ResponseArchiveMiddleware" : 100, # after decompression and redirects
+        },
+        "SPIDER_MIDDLEWARES" : {
+            "scraping.middlewares.ParseTimeMiddleware" : 1000, # closest to spider callbacks
+        },
+        "EXTENSIONS" : {
+            "scraping.crawl_stats.CrawlStatsExtension" : 500,
+        },
+    }
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -38,12 +100,85 @@ class PikabuSpider(scrapy.Spider):
         self.to_month = current_time.month
         self.to_day = current_time.day
         self.page_max_number = PikabuSpider.page_max_number
-        self.posts_data = {}
-        self.full_data = {}
+        self.crawl_state = CrawlState(PikabuSpider.crawl_state_file, resume=PikabuSpider.should_resume)
+        self.parser = PARSERS[PikabuSpider.parser_backend]()
+        processes = PikabuSpider.precise_parse_processes
+        self.parse_pool = ParsePool(PikabuSpider.parser_backend, processes) if processes is not None else None
+        refresh_days = PikabuSpider.precise_refresh_days
+        self.seen_posts = SeenPostIndex(PikabuSpider.seen_posts_file,
+                                        refresh_seconds=refresh_days*24*60*60 if refresh_days is not None else None,
+                                        shards_folder=PikabuSpider.shards_folder)
+        self.crawled_days = read_crawled_days(PikabuSpider.shards_folder) if PikabuSpider.incremental else {}
+        # Days whose listing page failed are left unfinished in crawl state to be resumed by the next run
+        self.failed_days = set()
+        self.failed_posts = set()
+
+    def _should_crawl_day(self, date):
+        if not PikabuSpider.incremental:
+            return True
+        settling = datetime.timedelta(days=PikabuSpider.settling_days)
+        if date > datetime.date.today() - settling:
+            return True
+        day = date.isoformat()
+        if day not in self.crawled_days:
+            return True
+        return datetime.date.fromisoformat(self.crawled_days[day]) - date < settling
+
+    def _listing_url(self, date, page_number):
+        if PikabuSpider.parse_method == ParseMethod.GENERAL:
+            date_str = "{0:02d}-{1:02d}-{2:04d}".format(date.day, date.month, date.year)
+            return 'http://pikabu.ru/best/' + date_str + "?page=" + str(page_number)
+        url = "http://pikabu.ru/search.php?d=" + str(search_day(date)) + "&t=%D0%9F%D0%BE%D0%BB%D0%B8%D1%82%D0%B8%D0%BA%D0%B0"
+        if page_number == 1:
+            return url
+        return url + "&page=" + str(page_number)
+
+    def _listing_request(self, date, page_number):
+        # Deeper pages go first, so started days are finished before new ones are begun
+        return scrapy.Request(self._listing_url(date, page_number), self.parse, errback=self.listing_failed,
+                              priority=page_number, meta={"day" : date.isoformat(), "page" : page_number})
+
+    def listing_failed(self, failure):
+        request = failure.request
+        self.logger.error("Listing page {} of {} failed, day is left unfinished: {}".format(
+            request.meta["page"], request.meta["day"], failure.getErrorMessage()))
+        self.failed_days.add(request.meta["day"])
+
+    def precise_failed(self, failure):
+        url = failure.request.meta["precise_url"]
+        self.logger.error("Post {} failed, it stays queued: {}".format(url, failure.getErrorMessage()))
+        self.failed_posts.add(url)
+
+    def _day_start_request(self, date):
+        """
+        Only the first unfinished page of the day is requested, every next page is requested
+        from 'parse' after previous one turned out to have stories
+        """
+        if not self._should_crawl_day(date):
+            return None
+        day = date.isoformat()
+        if self.crawl_state.is_day_exhausted(day):
+            return None
+        page_number = self.crawl_state.last_finished_page(day) + 1
+        if page_number > self.page_max_number:
+            return None
+        print("Day {} from page {}".format(day, page_number))
+        return self._listing_request(date, page_number)
+
+    def _precise_request(self, url):
+        # Above every listing page, so queued posts are fetched before more listings are expanded
+        return scrapy.Request(url, self.parse_precise, errback=self.precise_failed, priority=self.page_max_number + 1,
+                              meta={"precise_url" : url})
 
     def start_requests(self):
         print("Begin creating start_requests")
 
+        pending_posts = self.crawl_state.pending_posts()
+        if pending_posts:
+            print("Resuming {} unfinished precise requests".format(len(pending_posts)))
+        for url in pending_posts:
+            yield self._precise_request(url)
+
         if PikabuSpider.parse_method == ParseMethod.GENERAL:
             from_month = self.from_month
             from_day = self.from_day
@@ -53,151 +188,89 @@ class PikabuSpider(scrapy.Spider):
                     max_day = monthrange(year_number, month_number)[1]
                     to_day = self.to_day if year_number == self.to_year and month_number == self.to_month else max_day
                     for day_number in range(from_day, to_day+1):
-                        date_str = "{0:02d}-{1:02d}-{2:04d}".format(day_number, month_number, year_number)
-                        print("Day " + date_str)
-                        for page_number in range(1, self.page_max_number + 1):
-                            print("Page {}".format(page_number))
-                            yield scrapy.Request('http://pikabu.ru/best/' + date_str + "?page=" + str(page_number), self.parse)
+                        request = self._day_start_request(datetime.date(year_number, month_number, day_number))
+                        if request is not None:
+                            yield request
                     from_day = 1
                 from_month = 1
         elif PikabuSpider.parse_method == ParseMethod.POLITICS:
             start_date = datetime.date(self.from_year, self.from_month, self.from_day)
             end_date = datetime.date(self.to_year, self.to_month, self.to_day)
             for d in daterange(start_date, end_date):
-                day = search_day(d)
-                for page_n in range(1, self.page_max_number + 1):
-                    if page_n == 1:
-                        yield scrapy.Request("http://pikabu.ru/search.php?d=" + str(day) + "&t=%D0%9F%D0%BE%D0%BB%D0%B8%D1%82%D0%B8%D0%BA%D0%B0", self.parse)
-                    else:
-                        yield scrapy.Request("http://pikabu.ru/search.php?d=" + str(day) + "&t=%D0%9F%D0%BE%D0%BB%D0%B8%D1%82%D0%B8%D0%BA%D0%B0&page=" + str(page_n), self.parse)
+                request = self._day_start_request(d)
+                if request is not None:
+                    yield request
 
 
         print("Done creating start_requests")
 
-    def _is_placeholder_story(self, story):
-        if story.root.attrib['data-story-id'] == "_":
-            return True
-        try:
-            rating = int(story.xpath('.//div[@class="story__rating-count"]/text()').extract_first().strip())
-        except ValueError:
-            return True
-        return False
-
-    def _parse_basic_story_data(self, story):
-        id = int(story.root.attrib['data-story-id'])
-        title = story.xpath('.//div[@class="story__header-title"]')[0].xpath('.//a/text()').extract_first()
-        author = story.xpath('.//a[@class="story__author"]/text()').extract_first()
-        rating = int(story.xpath('.//div[@class="story__rating-count"]/text()').extract_first().strip())
-        comments_number = int(story.xpath('.//a[@class="story__comments-count story__to-comments"]/text()').extract_first().split()[0])
-        timestamp = int(story.xpath('.//div[@class="story__date"]')[0].root.attrib["title"])
-        tags = [tag.strip().lower() for tag in story.xpath('.//div[@class="story__tags"]')[0].xpath('.//a[@class="story__tag"]/text()').extract()]
-        return id, {
-                "title" : title,
-                "rating" : rating,
-                "comments_number" : comments_number,
-                "tags" : tags,
-                "timestamp" : timestamp,
-                "author" : author,
-                }
-
     def parse(self, response):
-        if response.xpath('//div[@id="no_stories_msg"]'):
+        if self.parser.is_empty_page(response):
+            yield from self._finish_page(response, has_stories=False)
             return
-        stories = response.xpath('//div[@class="story"]')
-        l = len(stories)
-        for i, s in enumerate(stories):
-            print("Extracting story {}/{}".format(i + 1, l))
-            if self._is_placeholder_story(s):
-                continue
-            id, story_data = self._parse_basic_story_data(s)
+        stories = self.parser.parse_listing(response)
+        has_stories = len(stories) > 0
+        for id, story_data, precise_post_link in stories:
             story_data["link"] = response._url
-            self.posts_data[id] = story_data
-            if PikabuSpider.should_extract_comments_data:
-                precise_post_link = s.xpath('.//div[@class="story__header-title"]')[0].xpath('.//a')[0].root.attrib["href"].strip()
-                yield scrapy.Request(precise_post_link, self.parse_precise)
+            yield {"kind" : STORY_ITEM, "id" : id, "data" : story_data}
+            if PikabuSpider.should_extract_comments_data and self.seen_posts.should_fetch(id):
+                if not self.crawl_state.is_post_finished(precise_post_link):
+                    self.crawl_state.mark_post_queued(precise_post_link)
+                    yield self._precise_request(precise_post_link)
+        yield from self._finish_page(response, has_stories)
+        if has_stories and "day" in response.meta and response.meta["page"] < self.page_max_number:
+            yield self._listing_request(datetime.date.fromisoformat(response.meta["day"]), response.meta["page"] + 1)
 
+    def _finish_page(self, response, has_stories):
+        """
+        Checkpoints listing page. After the last page of the day the day is reported as crawled,
+        even if it had no stories at all
+        """
+        if "day" in response.meta:
+            day, page_number = response.meta["day"], response.meta["page"]
+            self.crawl_state.mark_page_finished(day, page_number)
+            if not has_stories or page_number >= self.page_max_number:
+                self.crawl_state.mark_day_exhausted(day)
+                yield {"kind" : DAY_CRAWLED_ITEM, "day" : day}
 
-    def parse_precise(self, response):
-        print("On precise request")
-        if response.xpath('//div[@id="no_stories_msg"]'):
-            return
-        post_id, story_data = self._parse_basic_story_data(response.xpath('//div[@class="story"]')[0])
-        number_of_received_comments = len(response.xpath('//div[@class="b-comment"]'))
-        story_data["link"] = response._url
-        story_data["number_of_received_comments"] = number_of_received_comments
-        comments = []
-        for comment in response.xpath('//div[@class="b-comment"]'):
-            parent = comment.root.attrib["data-parent-id"]
-            id = comment.root.attrib["id"]
-            comment_body = comment.xpath('div[@class="b-comment__body "]')
-            if not comment_body: continue #last comment placeholder
-            comment_body = comment_body[0]
-            header_section = comment_body.xpath('div[@class="b-comment__header"]')[0]
-            content_section = comment_body.xpath('div[@class="b-comment__content"]')[0]
-            try:
-                rating = int(header_section.xpath('div[@class="b-comment__rating-count"]/text()')[0].extract())
-            except IndexError:
-                continue #skipping last story placeholder
-            user = header_section.xpath('div[@class="b-comment__user"]')[0].xpath('a')[0].xpath('span/text()')[0].extract()
-            timestamp = header_section.xpath('div[@class="b-comment__user"]')[0].xpath('time')[0].root.attrib["datetime"]
-            text = content_section.root.text.strip()
-            number_of_images = len(content_section.xpath('div[@class="b-p b-p_type_image"]'))
-            comments.append({
-                "parent" : parent,
-                "id" : id,
-                "content_section" : content_section,
-                "rating" : rating,
-                "user" : user,
-                "timestamp" : timestamp,
-                "text" : text,
-                "number_of_images" : number_of_images,
-            })
-        story_data["comments"] = comments
-        self.full_data[post_id] = story_data
+    def _mark_post_finished(self, response):
+        if "precise_url" in response.meta:
+            self.crawl_state.mark_post_finished(response.meta["precise_url"])
+
+
+    async def parse_precise(self, response):
+        if self.parse_pool is not None:
+            # Reactor thread serves other responses while the worker parses this one
+            response.meta[PARSE_TIME_META], parsed = await maybe_deferred_to_future(self.parse_pool.parse_precise(response))
+        else:
+            parsed = None if self.parser.is_empty_page(response) else self.parser.parse_precise(response)
+        for item in self._precise_items(response, parsed):
+            yield item
+
+    def _precise_items(self, response, parsed):
+        # Post is marked fetched and finished only after its item is taken by the engine
+        if parsed is not None:
+            post_id, story_data = parsed
+            story_data["link"] = response._url
+            yield {"kind" : PRECISE_ITEM, "id" : post_id, "data" : story_data}
+            self.seen_posts.mark_fetched(post_id)
+        self._mark_post_finished(response)
 
     def closed(self, reason):
         print("Spider closed. Processing data")
+        if reason == "finished" and not self.failed_days and not self.failed_posts:
+            self.crawl_state.finish()
+        else:
+            if self.failed_days:
+                self.logger.warning("Days {} are unfinished and will be resumed by the next run".format(", ".join(sorted(self.failed_days))))
+            if self.failed_posts:
+                self.logger.warning("{} posts failed and will be resumed by the next run".format(len(self.failed_posts)))
+            self.crawl_state.close()
+        self.seen_posts.close()
+        if self.parse_pool is not None:
+            self.parse_pool.close()
 
-        len_before = len(self.posts_data)
-
-        # There seems to be a few strange duplicates. Let's remove them.
-        keys = sorted(list(self.posts_data.keys()))
-        result = {}
-        for i, k in enumerate(keys):
-            new_key = (self.posts_data[k]["title"], self.posts_data[k]["comments_number"], "_".join(self.posts_data[k]["tags"]))
-            if new_key in result:
-                result[new_key]["number"] += 1
-                result[new_key]["keys"].append((k, self.posts_data[k]["rating"]))
-            else:
-                result[new_key] = {
-                    "number" : 1,
-                    "keys" : [(k, self.posts_data[k]["rating"])]
-                }
-
-        result = {key: value for key, value in result.items() if value["number"] > 1}
-        for gist in result.values():
-            keys = sorted(gist["keys"], key=lambda x: -x[1])
-            for key in keys[1:]:
-                del self.posts_data[key[0]]
-
-        len_after = len(self.posts_data)
-        print("{} duplicates removed".format(len_before - len_after))
-
-        # Also Pikabu seems to store timestamps as Coordinated Universal Time, let's rewind them to UTC+3 (Moscow)
-        for key in self.posts_data.keys():
-            self.posts_data[key]["timestamp"] += 3*60*60
-
-        print("Pickling data")
-
-        with open("data.pkl", "wb") as handle:
-            pickle.dump(self.posts_data, handle, protocol=pickle.HIGHEST_PROTOCOL)
-
-        if PikabuSpider.should_extract_comments_data:
-            # But no need to clean full data, duplicates already got overwritten
-            with open("full_data.pkl", "wb") as handle:
-                pickle.dump(self.full_data, handle, protocol=pickle.HIGHEST_PROTOCOL)
-
-        print("DONE")
+        build_datasets(self.shards_folder, PikabuSpider.should_extract_comments_data)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,100 @@
+import os
+
+
+CRAWL_STATE_FILE = "crawl_state.log"
+
+_PAGE_FINISHED = "page"
+_DAY_EXHAUSTED = "exhausted"
+_POST_QUEUED = "queued"
+_POST_FINISHED = "precise"
+
+
+class CrawlState:
+    """
+    Append-only log of crawl progress: finished (day, page) listing pages, days which ran out of stories,
+    precise post urls queued by finished listings and finished precise post urls. Every event is flushed immediately, so after
+    an interruption the log is replayed and only unfinished work is scheduled again.
+    With path None the state is kept in memory only.
+    """
+
+    def __init__(self, path=CRAWL_STATE_FILE, resume=True):
+        self.path = path
+        self.finished_pages = {}
+        self.exhausted_days = set()
+        self.queued_posts = {}
+        self.finished_posts = set()
+        self._handle = None
+        if path is None:
+            return
+        if resume and os.path.exists(path):
+            self._replay()
+            mode = "a"
+        else:
+            mode = "w"
+        self._handle = open(path, mode, encoding="utf-8")
+
+    def _replay(self):
+        with open(self.path, "r", encoding="utf-8") as handle:
+            for line in handle:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) != 3:
+                    continue # line torn by interruption
+                event, key, value = fields
+                if event == _PAGE_FINISHED:
+                    self.finished_pages[key] = max(self.finished_pages.get(key, 0), int(value))
+                elif event == _DAY_EXHAUSTED:
+                    self.exhausted_days.add(key)
+                elif event == _POST_QUEUED:
+                    self.queued_posts[key] = None
+                elif event == _POST_FINISHED:
+                    self.finished_posts.add(key)
+
+    def _log(self, event, key, value=""):
+        if self._handle is None:
+            return
+        self._handle.write("{}\t{}\t{}\n".format(event, key, value))
+        self._handle.flush()
+
+    def last_finished_page(self, day):
+        """
+        :return: Number of the last finished listing page of the day or 0 if none
+        """
+        return self.finished_pages.get(day, 0)
+
+    def mark_page_finished(self, day, page):
+        self.finished_pages[day] = max(self.finished_pages.get(day, 0), page)
+        self._log(_PAGE_FINISHED, day, page)
+
+    def is_day_exhausted(self, day):
+        return day in self.exhausted_days
+
+    def mark_day_exhausted(self, day):
+        self.exhausted_days.add(day)
+        self._log(_DAY_EXHAUSTED, day)
+
+    def mark_post_queued(self, url):
+        if url not in self.queued_posts:
+            self.queued_posts[url] = None
+            self._log(_POST_QUEUED, url)
+
+    def is_post_finished(self, url):
+        return url in self.finished_posts
+
+    def mark_post_finished(self, url):
+        self.finished_posts.add(url)
+        self._log(_POST_FINISHED, url)
+
+    def pending_posts(self):
+        return [url for url in self.queued_posts if url not in self.finished_posts]
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+
+    def finish(self):
+        """
+        Crawl completed, nothing to resume
+        """
+        self.close()
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,195 @@
+import json
+import os
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+from scrapy import signals
+from twisted.internet import task
+
+
+CRAWL_STATS_FILE = "crawl_stats.json"
+PERCENTILES = [50, 90, 99]
+# Latency and parse time percentiles are computed over this many latest samples
+SAMPLES_WINDOW = 10000
+_STATUS_COUNT_PREFIX = "downloader/response_status_count/"
+# Async callbacks which await work done elsewhere (e.g. in ParsePool) put the time of that work here
+PARSE_TIME_META = "parse_time"
+
+
+def _percentiles(samples):
+    if not samples:
+        return {"p{}".format(q): None for q in PERCENTILES}
+    values = np.percentile(np.fromiter(samples, dtype=np.float64, count=len(samples)), PERCENTILES)
+    return {"p{}".format(q): float(value) for q, value in zip(PERCENTILES, values)}
+
+
+class CrawlStats:
+    """
+    Counters and latency samples shared by CrawlStatsExtension and stats middlewares of one crawler.
+    Request, byte and exception counts are taken from scrapy stats collected by DownloaderStats.
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.download_latencies = deque(maxlen=SAMPLES_WINDOW)
+        self.parse_times = defaultdict(lambda: deque(maxlen=SAMPLES_WINDOW))
+        self.callback_times = defaultdict(lambda: deque(maxlen=SAMPLES_WINDOW))
+        self.parsed_pages = defaultdict(int)
+        self.empty_pages = defaultdict(int)
+        self.spider_errors = 0
+
+    def add_download_latency(self, latency):
+        self.download_latencies.append(latency)
+
+    def add_parsed_page(self, callback, parse_time, number_of_items, callback_time=None):
+        """
+        :param callback_time: Wall time of async callback including its awaits (e.g. queueing for
+                              a parse worker), None for synchronous callbacks
+        """
+        self.parse_times[callback].append(parse_time)
+        if callback_time is not None:
+            self.callback_times[callback].append(callback_time)
+        self.parsed_pages[callback] += 1
+        if number_of_items == 0:
+            self.empty_pages[callback] += 1
+
+    def recent_latency(self, number_of_samples):
+        """
+        :return: 90th percentile of latest download latencies or None if there are none
+        """
+        if not self.download_latencies:
+            return None
+        latest = list(self.download_latencies)[-number_of_samples:]
+        return float(np.percentile(latest, 90))
+
+    def report(self, scrapy_stats, concurrency=None):
+        elapsed = max(time.time() - self.start_time, 1e-9)
+        requests = scrapy_stats.get("downloader/request_count", 0)
+        response_bytes = scrapy_stats.get("downloader/response_bytes", 0)
+        # Redirects and not modified responses are not errors
+        bad_responses = sum(count for key, count in scrapy_stats.items()
+                            if key.startswith(_STATUS_COUNT_PREFIX) and key[len(_STATUS_COUNT_PREFIX):][:1] in ("4", "5"))
+        errors = scrapy_stats.get("downloader/exception_count", 0) + bad_responses + self.spider_errors
+        parsed_pages = sum(self.parsed_pages.values())
+        empty_pages = sum(self.empty_pages.values())
+        parse_time = {}
+        for callback, samples in self.parse_times.items():
+            parse_time[callback] = {"count" : self.parsed_pages[callback],
+                                    "empty_pages" : self.empty_pages[callback],
+                                    "mean" : float(np.mean(samples))}
+            parse_time[callback].update(_percentiles(samples))
+        callback_time = {}
+        for callback, samples in self.callback_times.items():
+            callback_time[callback] = {"mean" : float(np.mean(samples))}
+            callback_time[callback].update(_percentiles(samples))
+        return {
+            "elapsed_seconds" : elapsed,
+            "requests" : requests,
+            "requests_per_second" : requests/elapsed,
+            "response_bytes" : response_bytes,
+            "bytes_per_second" : response_bytes/elapsed,
+            "errors" : errors,
+            "error_rate" : errors/max(requests, 1),
+            "empty_pages" : empty_pages,
+            "empty_page_rate" : empty_pages/max(parsed_pages, 1),
+            "concurrency" : concurrency,
+            "download_latency" : _percentiles(self.download_latencies),
+            "parse_time" : parse_time,
+            "callback_time" : callback_time,
+        }
+
+
+def crawl_stats_of(crawler):
+    """
+    :return: CrawlStats of the crawler, created on first access
+    """
+    if not hasattr(crawler, "crawl_stats"):
+        crawler.crawl_stats = CrawlStats()
+    return crawler.crawl_stats
+
+
+class ConcurrencyController:
+    """
+    Additive increase, multiplicative decrease of concurrency: one more request in flight while
+    latency is below target, half as many once it is above
+    """
+
+    def __init__(self, target_latency, concurrency, min_concurrency=1, max_concurrency=32):
+        self.target_latency = target_latency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.concurrency = min(max(concurrency, min_concurrency), max_concurrency)
+
+    def update(self, latency):
+        if latency is None:
+            return self.concurrency
+        if latency > self.target_latency:
+            self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+        elif self.concurrency < self.max_concurrency:
+            self.concurrency += 1
+        return self.concurrency
+
+
+class CrawlStatsExtension:
+    """
+    Every 'crawl_stats_interval' seconds dumps throughput report into spider 'crawl_stats_file'.
+    If spider 'target_latency' is not None, concurrency of downloader is tuned to keep
+    90th percentile of download latency below it
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.stats = crawl_stats_of(crawler)
+        self.controller = None
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        extension = cls(crawler)
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        crawler.signals.connect(extension.spider_error, signal=signals.spider_error)
+        return extension
+
+    def spider_opened(self, spider):
+        self.path = getattr(spider, "crawl_stats_file", CRAWL_STATS_FILE)
+        target_latency = getattr(spider, "target_latency", None)
+        if target_latency is not None:
+            self.controller = ConcurrencyController(target_latency, self.crawler.settings.getint("CONCURRENT_REQUESTS_PER_DOMAIN"),
+                                                    max_concurrency=self.crawler.settings.getint("CONCURRENT_REQUESTS"))
+        self.task = task.LoopingCall(self.on_interval)
+        self.task.start(getattr(spider, "crawl_stats_interval", 60), now=False)
+
+    def response_received(self, response, request, spider):
+        if "download_latency" in request.meta:
+            self.stats.add_download_latency(request.meta["download_latency"])
+
+    def spider_error(self, failure, response, spider):
+        self.stats.spider_errors += 1
+
+    def _set_concurrency(self, concurrency):
+        downloader = self.crawler.engine.downloader
+        downloader.domain_concurrency = concurrency # for slots created later
+        for slot in downloader.slots.values():
+            slot.concurrency = concurrency
+
+    def on_interval(self):
+        if self.controller is not None:
+            # Latency of the latest requests, a few per slot of current concurrency
+            self._set_concurrency(self.controller.update(self.stats.recent_latency(self.controller.concurrency*4)))
+        self.dump()
+
+    def dump(self):
+        concurrency = self.controller.concurrency if self.controller is not None else None
+        report = self.stats.report(self.crawler.stats.get_stats(), concurrency)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as fp:
+            json.dump(report, fp, indent=4)
+        os.replace(tmp_path, self.path)
+
+    def spider_closed(self, spider):
+        if self.task is not None and self.task.running:
+            self.task.stop()
+        self.dump()
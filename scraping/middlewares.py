@@ -0,0 +1,95 @@
+import time
+
+from scrapy import signals
+
+from scraping.crawl_stats import crawl_stats_of, PARSE_TIME_META
+from scraping.pipelines import DAY_CRAWLED_ITEM
+from storage.response_archive import ResponseArchive, RESPONSE_ARCHIVE_FOLDER
+
+
+# Request meta keys needed to replay a response through spider callbacks
+ARCHIVED_META_KEYS = ["day", "page", "precise_url"]
+
+
+class ResponseArchiveMiddleware:
+    """
+    Downloader middleware writing every successful response into ResponseArchive
+    when spider has 'should_archive_responses' set
+    """
+
+    def __init__(self):
+        self.archive = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        middleware = cls()
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def process_response(self, request, response, spider):
+        if not getattr(spider, "should_archive_responses", False) or response.status != 200:
+            return response
+        if self.archive is None:
+            self.archive = ResponseArchive(getattr(spider, "response_archive_folder", RESPONSE_ARCHIVE_FOLDER))
+        callback = request.callback.__name__ if request.callback is not None else "parse"
+        meta = {key: request.meta[key] for key in ARCHIVED_META_KEYS if key in request.meta}
+        self.archive.store(response.url, response.body, callback, meta, getattr(response, "encoding", "utf-8"))
+        return response
+
+    def spider_closed(self, spider):
+        if self.archive is not None:
+            self.archive.close()
+
+
+class ParseTimeMiddleware:
+    """
+    Spider middleware timing spider callbacks. Callbacks are generators, so time is accumulated
+    while their output is being pulled. Page is empty if its callback produced no story items.
+    Pulling output of async callbacks also waits for whatever they await, so that wall time is
+    reported as callback time, and parse time is taken from PARSE_TIME_META when callback sets it
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawl_stats_of(crawler))
+
+    def _callback_name(self, response):
+        callback = response.request.callback if response.request is not None else None
+        return callback.__name__ if callback is not None else "parse"
+
+    def process_spider_output(self, response, result, spider):
+        parse_time, number_of_items = 0.0, 0
+        result = iter(result)
+        while True:
+            begin = time.perf_counter()
+            try:
+                output = next(result)
+            except StopIteration:
+                break
+            finally:
+                parse_time += time.perf_counter() - begin
+            if isinstance(output, dict) and output.get("kind") != DAY_CRAWLED_ITEM:
+                number_of_items += 1
+            yield output
+        self.stats.add_parsed_page(self._callback_name(response), parse_time, number_of_items)
+
+    async def process_spider_output_async(self, response, result, spider):
+        # Used by scrapy when middlewares before this one produce asynchronous output
+        callback_time, number_of_items = 0.0, 0
+        result = result.__aiter__()
+        while True:
+            begin = time.perf_counter()
+            try:
+                output = await result.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                callback_time += time.perf_counter() - begin
+            if isinstance(output, dict) and output.get("kind") != DAY_CRAWLED_ITEM:
+                number_of_items += 1
+            yield output
+        parse_time = response.meta.get(PARSE_TIME_META, callback_time)
+        self.stats.add_parsed_page(self._callback_name(response), parse_time, number_of_items, callback_time)
@@ -0,0 +1,58 @@
+from concurrent.futures import ProcessPoolExecutor
+import time
+
+from scrapy.http import HtmlResponse
+from twisted.internet.defer import Deferred
+
+from scraping.parsers import PARSERS
+
+
+_parser = None
+
+
+def _init_worker(parser_backend):
+    global _parser
+    _parser = PARSERS[parser_backend]()
+
+
+def _parse_precise(url, body, encoding):
+    """
+    :return: Parse time in the worker and (story id, story data), None for empty page
+    """
+    begin = time.perf_counter()
+    response = HtmlResponse(url=url, body=body, encoding=encoding)
+    parsed = None if _parser.is_empty_page(response) else _parser.parse_precise(response)
+    return time.perf_counter() - begin, parsed
+
+
+def _fire(deferred, future):
+    try:
+        result = future.result()
+    except Exception:
+        deferred.errback()
+        return
+    deferred.callback(result)
+
+
+class ParsePool:
+    """
+    Parses precise pages in worker processes, so comment extraction does not block the reactor thread.
+    Only response body goes to a worker, Comment records come back
+    """
+
+    def __init__(self, parser_backend, processes=None):
+        self.executor = ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(parser_backend,))
+
+    def parse_precise(self, response):
+        """
+        :return: Deferred fired in reactor thread with parse time in the worker and
+                 (story id, story data), None for empty page
+        """
+        from twisted.internet import reactor # installed by scrapy before crawl starts
+        deferred = Deferred()
+        future = self.executor.submit(_parse_precise, response.url, response.body, response.encoding)
+        future.add_done_callback(lambda future: reactor.callFromThread(_fire, deferred, future))
+        return deferred
+
+    def close(self):
+        self.executor.shutdown()
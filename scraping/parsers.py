@@ -0,0 +1,217 @@
+from enum import Enum
+
+from lxml import etree
+
+from storage.records import make_comment
+
+
+class ParserBackend(Enum):
+    SELECTORS=1
+    COMPILED=2
+
+
+class SelectorParser:
+    """
+    Reference parser: evaluates every XPath query with scrapy selectors
+    """
+
+    def is_empty_page(self, response):
+        return bool(response.xpath('//div[@id="no_stories_msg"]'))
+
+    def _is_placeholder_story(self, story):
+        if story.root.attrib['data-story-id'] == "_":
+            return True
+        try:
+            rating = int(story.xpath('.//div[@class="story__rating-count"]/text()').extract_first().strip())
+        except ValueError:
+            return True
+        return False
+
+    def _parse_basic_story_data(self, story):
+        id = int(story.root.attrib['data-story-id'])
+        title = story.xpath('.//div[@class="story__header-title"]')[0].xpath('.//a/text()').extract_first()
+        author = story.xpath('.//a[@class="story__author"]/text()').extract_first()
+        rating = int(story.xpath('.//div[@class="story__rating-count"]/text()').extract_first().strip())
+        comments_number = int(story.xpath('.//a[@class="story__comments-count story__to-comments"]/text()').extract_first().split()[0])
+        timestamp = int(story.xpath('.//div[@class="story__date"]')[0].root.attrib["title"])
+        tags = [tag.strip().lower() for tag in story.xpath('.//div[@class="story__tags"]')[0].xpath('.//a[@class="story__tag"]/text()').extract()]
+        return id, {
+                "title" : title,
+                "rating" : rating,
+                "comments_number" : comments_number,
+                "tags" : tags,
+                "timestamp" : timestamp,
+                "author" : author,
+                }
+
+    def parse_listing(self, response):
+        """
+        :return: List of (story_id, story_data, precise_post_link) for every non-placeholder story
+        """
+        result = []
+        for s in response.xpath('//div[@class="story"]'):
+            if self._is_placeholder_story(s):
+                continue
+            id, story_data = self._parse_basic_story_data(s)
+            precise_post_link = s.xpath('.//div[@class="story__header-title"]')[0].xpath('.//a')[0].root.attrib["href"].strip()
+            result.append((id, story_data, precise_post_link))
+        return result
+
+    def parse_precise(self, response):
+        """
+        :return: Story id and story data with 'number_of_received_comments' and 'comments' list of Comment
+        """
+        post_id, story_data = self._parse_basic_story_data(response.xpath('//div[@class="story"]')[0])
+        number_of_received_comments = len(response.xpath('//div[@class="b-comment"]'))
+        story_data["number_of_received_comments"] = number_of_received_comments
+        comments = []
+        for comment in response.xpath('//div[@class="b-comment"]'):
+            parent = comment.root.attrib["data-parent-id"]
+            id = comment.root.attrib["id"]
+            comment_body = comment.xpath('div[@class="b-comment__body "]')
+            if not comment_body: continue #last comment placeholder
+            comment_body = comment_body[0]
+            header_section = comment_body.xpath('div[@class="b-comment__header"]')[0]
+            content_section = comment_body.xpath('div[@class="b-comment__content"]')[0]
+            try:
+                rating = int(header_section.xpath('div[@class="b-comment__rating-count"]/text()')[0].extract())
+            except IndexError:
+                continue #skipping last story placeholder
+            user = header_section.xpath('div[@class="b-comment__user"]')[0].xpath('a')[0].xpath('span/text()')[0].extract()
+            timestamp = header_section.xpath('div[@class="b-comment__user"]')[0].xpath('time')[0].root.attrib["datetime"]
+            text = content_section.root.text.strip()
+            number_of_images = len(content_section.xpath('div[@class="b-p b-p_type_image"]'))
+            comments.append(make_comment(id, parent, user, rating, timestamp, text, number_of_images))
+        story_data["comments"] = comments
+        return post_id, story_data
+
+
+# smart_strings=False makes results plain strings which do not keep the whole document alive
+_no_stories_xpath = etree.XPath('//div[@id="no_stories_msg"]')
+_stories_xpath = etree.XPath('//div[@class="story"]')
+_comments_xpath = etree.XPath('//div[@class="b-comment"]')
+_text_nodes_xpath = etree.XPath('text()', smart_strings=False)
+_links_xpath = etree.XPath('.//a')
+_link_texts_xpath = etree.XPath('.//a/text()', smart_strings=False)
+_tag_texts_xpath = etree.XPath('.//a[@class="story__tag"]/text()', smart_strings=False)
+_span_texts_xpath = etree.XPath('span/text()', smart_strings=False)
+
+_HEADER_TITLE = ("div", "story__header-title")
+_AUTHOR = ("a", "story__author")
+_RATING = ("div", "story__rating-count")
+_COMMENTS_COUNT = ("a", "story__comments-count story__to-comments")
+_DATE = ("div", "story__date")
+_TAGS = ("div", "story__tags")
+_STORY_SECTIONS = {_HEADER_TITLE, _AUTHOR, _RATING, _COMMENTS_COUNT, _DATE, _TAGS}
+
+# Helpers below mirror scrapy selector idioms, including the exception raised when a node is missing:
+# lists are indexed with [0] (IndexError), attributes with attrib[...] (KeyError), and a missing
+# text is None like extract_first()
+
+
+def _first_text(elements):
+    """
+    Same as extract_first() of 'section/text()' query: the first text node of any of the elements
+    """
+    for element in elements:
+        texts = _text_nodes_xpath(element)
+        if texts:
+            return texts[0]
+    return None
+
+
+def _children(element, tag, cls=None):
+    return [child for child in element if child.tag == tag and (cls is None or child.get("class") == cls)]
+
+
+def _story_sections(story):
+    """
+    Single walk over story subtree collecting elements of every section in document order
+    """
+    sections = {}
+    for element in story.iter("div", "a"):
+        key = (element.tag, element.get("class"))
+        if key in _STORY_SECTIONS:
+            sections.setdefault(key, []).append(element)
+    return sections
+
+
+class CompiledParser:
+    """
+    Parser working on lxml tree with precompiled XPath expressions. Walks every story and comment
+    node once and returns the same data as SelectorParser
+    """
+
+    def is_empty_page(self, response):
+        return bool(_no_stories_xpath(response.selector.root))
+
+    def _is_placeholder_story(self, story, sections):
+        if story.attrib['data-story-id'] == "_":
+            return True
+        try:
+            rating = int(_first_text(sections.get(_RATING, ())).strip())
+        except ValueError:
+            return True
+        return False
+
+    def _parse_basic_story_data(self, story, sections):
+        id = int(story.attrib['data-story-id'])
+        titles = _link_texts_xpath(sections.get(_HEADER_TITLE, [])[0])
+        author = _first_text(sections.get(_AUTHOR, ()))
+        rating = int(_first_text(sections.get(_RATING, ())).strip())
+        comments_number = int(_first_text(sections.get(_COMMENTS_COUNT, ())).split()[0])
+        timestamp = int(sections.get(_DATE, [])[0].attrib["title"])
+        tags = [tag.strip().lower() for tag in _tag_texts_xpath(sections.get(_TAGS, [])[0])]
+        return id, {
+                "title" : titles[0] if titles else None,
+                "rating" : rating,
+                "comments_number" : comments_number,
+                "tags" : tags,
+                "timestamp" : timestamp,
+                "author" : author,
+                }
+
+    def parse_listing(self, response):
+        result = []
+        for story in _stories_xpath(response.selector.root):
+            sections = _story_sections(story)
+            if self._is_placeholder_story(story, sections):
+                continue
+            id, story_data = self._parse_basic_story_data(story, sections)
+            precise_post_link = _links_xpath(sections[_HEADER_TITLE][0])[0].attrib["href"].strip()
+            result.append((id, story_data, precise_post_link))
+        return result
+
+    def parse_precise(self, response):
+        root = response.selector.root
+        story = _stories_xpath(root)[0]
+        post_id, story_data = self._parse_basic_story_data(story, _story_sections(story))
+        comment_nodes = _comments_xpath(root)
+        story_data["number_of_received_comments"] = len(comment_nodes)
+        comments = []
+        for comment in comment_nodes:
+            parent = comment.attrib["data-parent-id"]
+            id = comment.attrib["id"]
+            comment_body = _children(comment, "div", "b-comment__body ")
+            if not comment_body: continue #last comment placeholder
+            comment_body = comment_body[0]
+            header_section = _children(comment_body, "div", "b-comment__header")[0]
+            content_section = _children(comment_body, "div", "b-comment__content")[0]
+            rating_text = _first_text(_children(header_section, "div", "b-comment__rating-count"))
+            if rating_text is None:
+                continue #skipping last story placeholder
+            rating = int(rating_text)
+            user_section = _children(header_section, "div", "b-comment__user")[0]
+            user = _span_texts_xpath(_children(user_section, "a")[0])[0]
+            timestamp = _children(user_section, "time")[0].attrib["datetime"]
+            number_of_images = len(_children(content_section, "div", "b-p b-p_type_image"))
+            comments.append(make_comment(id, parent, user, rating, timestamp, content_section.text.strip(),
+                                         number_of_images))
+        story_data["comments"] = comments
+        return post_id, story_data
+
+
+PARSERS = {
+    ParserBackend.SELECTORS : SelectorParser,
+    ParserBackend.COMPILED : CompiledParser,
+}
@@ -0,0 +1,143 @@
+import datetime
+import hashlib
+import os
+import pickle
+
+from storage.shards import ShardWriter, shard_day, shard_days, iterate_shards, SHARDS_FOLDER, POSTS_KIND, FULL_KIND
+
+
+STORY_ITEM = "story"
+PRECISE_ITEM = "precise"
+# Emitted by spider after the last listing page of a day is parsed
+DAY_CRAWLED_ITEM = "day_crawled"
+
+DEDUP_INDEX_FILE = "dedup_index.pkl"
+
+# Pikabu seems to store timestamps as Coordinated Universal Time, let's rewind them to UTC+3 (Moscow)
+TIMEZONE_SHIFT = 3*60*60
+
+
+def item_to_shard_record(item):
+    """
+    :return: Shard kind and story data of spider item
+    """
+    return (POSTS_KIND if item["kind"] == STORY_ITEM else FULL_KIND), item["data"]
+
+
+def _dedup_key(story_data):
+    key = "\x1f".join([story_data["title"] or "", str(story_data["comments_number"]), "_".join(story_data["tags"])])
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class StoryDeduplicator:
+    """
+    There seems to be a few strange duplicates: same title, comments number and tags under different ids.
+    Keeps {64-bit hash of that key: (best story id, its rating, its shard day)} where the best story is
+    the highest rated one (smallest id among equally rated) and resolves duplicates as stories arrive.
+    Comments number changes between fetches, so every written story also has its current key
+    ('keys', derived from 'best'): a refetched story under a new key leaves its old entry.
+    """
+
+    def __init__(self, folder=SHARDS_FOLDER):
+        self.path = os.path.join(folder, DEDUP_INDEX_FILE)
+        self.best = {}
+        self.keys = {}
+        self.duplicates = 0
+        if self._is_index_fresh(folder):
+            with open(self.path, "rb") as handle:
+                self.best = pickle.load(handle)
+            self.keys = {best[0]: key for key, best in self.best.items()}
+        else:
+            self._rebuild(folder)
+
+    def _is_index_fresh(self, folder):
+        if not os.path.exists(self.path):
+            return False
+        index_time = os.path.getmtime(self.path)
+        return all(os.path.getmtime(os.path.join(folder, POSTS_KIND, day + ".pkl")) <= index_time
+                   for day in shard_days(folder, POSTS_KIND))
+
+    def _rebuild(self, folder):
+        # Index was never saved or crawl got interrupted after shards were appended
+        for post_id, story_data in iterate_shards(folder, POSTS_KIND):
+            if story_data is not None:
+                self.offer(post_id, story_data, shard_day(story_data["timestamp"]))
+            elif post_id in self.keys:
+                del self.best[self.keys.pop(post_id)]
+        self.duplicates = 0
+
+    def offer(self, story_id, story_data, day):
+        """
+        :return: Whether story should be written and (id, shard day) of previously written story to be
+        removed: either the one this story replaces or this very story, refetched as a worse duplicate
+        """
+        key = _dedup_key(story_data)
+        rating = story_data["rating"]
+        old_key = self.keys.get(story_id)
+        if old_key is not None and old_key != key:
+            del self.best[old_key]
+            del self.keys[story_id]
+        best = self.best.get(key)
+        if best is None or best[0] == story_id:
+            self.best[key] = (story_id, rating, day)
+            self.keys[story_id] = key
+            return True, None
+        self.duplicates += 1
+        if (rating, -story_id) > (best[1], -best[0]):
+            self.best[key] = (story_id, rating, day)
+            del self.keys[best[0]]
+            self.keys[story_id] = key
+            return True, (best[0], best[2])
+        return False, ((story_id, day) if old_key is not None else None)
+
+    def save(self):
+        with open(self.path, "wb") as handle:
+            pickle.dump(self.best, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class ShardWriterPipeline:
+    """
+    Streams scraped stories into posts shards and precise stories (with comments) into full shards.
+    Stories are deduplicated and shifted to Moscow time on ingest, replaced duplicates get tombstones
+    """
+
+    def open(self, folder=SHARDS_FOLDER):
+        self.writer = ShardWriter(folder)
+        self.deduplicator = StoryDeduplicator(folder)
+
+    def open_spider(self, spider):
+        self.open(getattr(spider, "shards_folder", SHARDS_FOLDER))
+
+    def process_item(self, item, spider=None):
+        if item["kind"] == DAY_CRAWLED_ITEM:
+            self.writer.mark_day_crawled(item["day"], datetime.date.today().isoformat())
+            return item
+        kind, story_data = item_to_shard_record(item)
+        if kind == POSTS_KIND:
+            story_data = dict(story_data)
+            story_data["timestamp"] += TIMEZONE_SHIFT
+            day = shard_day(story_data["timestamp"])
+            should_write, replaced = self.deduplicator.offer(item["id"], story_data, day)
+            if replaced is not None:
+                self.writer.append(POSTS_KIND, replaced[1], replaced[0], None)
+                if spider is not None:
+                    spider.crawler.stats.inc_value("dedup/replaced_stories")
+            if should_write:
+                self.writer.append(POSTS_KIND, day, item["id"], story_data)
+        else:
+            # No need to clean full data, duplicates get overwritten
+            self.writer.append(kind, shard_day(story_data["timestamp"]), item["id"], story_data)
+        return item
+
+    def close(self):
+        """
+        :return: Number of duplicate stories met
+        """
+        self.writer.close()
+        self.deduplicator.save()
+        return self.deduplicator.duplicates
+
+    def close_spider(self, spider):
+        duplicates = self.close()
+        spider.crawler.stats.set_value("dedup/duplicate_stories", duplicates)
+        spider.logger.info("{} duplicate stories skipped".format(duplicates))
@@ -0,0 +1,84 @@
+import os
+import time
+
+import numpy as np
+
+from storage.comment_store import COMMENT_STORE_FOLDER
+from storage.shards import iterate_shards, SHARDS_FOLDER, FULL_KIND
+
+
+SEEN_POSTS_FILE = "seen_posts.log"
+
+
+class SeenPostIndex:
+    """
+    Persistent index {story_id: unix time of last precise fetch} kept as append-only log.
+    On the first run it is seeded from existing comment store or full shards with their modification time.
+    With path None the index is kept in memory only.
+    """
+
+    def __init__(self, path=SEEN_POSTS_FILE, refresh_seconds=None, shards_folder=SHARDS_FOLDER,
+                 comment_store_folder=COMMENT_STORE_FOLDER):
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self.seen = {}
+        self._scheduled = set()
+        self._handle = None
+        if path is None:
+            return
+        if os.path.exists(path):
+            self._replay()
+            self._handle = open(path, "a", encoding="utf-8")
+        else:
+            self._handle = open(path, "w", encoding="utf-8")
+            self._seed(shards_folder, comment_store_folder)
+
+    def _replay(self):
+        with open(self.path, "r", encoding="utf-8") as handle:
+            for line in handle:
+                fields = line.split()
+                if len(fields) != 2:
+                    continue # line torn by interruption
+                self.seen[int(fields[0])] = int(fields[1])
+
+    def _seed(self, shards_folder, comment_store_folder):
+        post_ids_path = os.path.join(comment_store_folder, "post_ids.npy")
+        if os.path.exists(post_ids_path):
+            seen_time = int(os.path.getmtime(post_ids_path))
+            post_ids = np.load(post_ids_path, mmap_mode="r")
+        elif os.path.exists(os.path.join(shards_folder, FULL_KIND)):
+            seen_time = int(os.path.getmtime(os.path.join(shards_folder, FULL_KIND)))
+            post_ids = (post_id for post_id, _ in iterate_shards(shards_folder, FULL_KIND))
+        else:
+            return
+        for post_id in post_ids:
+            self.seen[int(post_id)] = seen_time
+            self._handle.write("{} {}\n".format(int(post_id), seen_time))
+        self._handle.flush()
+
+    def should_fetch(self, story_id, now=None):
+        """
+        True if post was never fetched or its last fetch is older than refresh window.
+        Returns True only once per story during the crawl, so duplicates from other pages are skipped
+        """
+        if story_id in self._scheduled:
+            return False
+        if story_id in self.seen:
+            if self.refresh_seconds is None:
+                return False
+            now = time.time() if now is None else now
+            if now - self.seen[story_id] < self.refresh_seconds:
+                return False
+        self._scheduled.add(story_id)
+        return True
+
+    def mark_fetched(self, story_id, fetch_time=None):
+        fetch_time = int(time.time()) if fetch_time is None else int(fetch_time)
+        self.seen[story_id] = fetch_time
+        if self._handle is not None:
+            self._handle.write("{} {}\n".format(story_id, fetch_time))
+            self._handle.flush()
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
@@ -0,0 +1,73 @@
+import numpy as np
+from scipy import signal
+
+
+# Kernels longer than this are applied through FFT
+FFT_KERNEL_LENGTH = 64
+
+
+def _correlate_valid(P, weights):
+    """
+    S[..., i] = sum_k weights[k]*P[..., i + k] along the last axis of 1-D series or 2-D batch of them
+    """
+    if len(weights) > FFT_KERNEL_LENGTH:
+        return signal.fftconvolve(P, np.broadcast_to(weights[::-1], P.shape[:-1] + weights.shape), mode="valid", axes=-1)
+    if P.ndim == 1:
+        return np.convolve(P, weights[::-1], mode="valid")
+    return np.lib.stride_tricks.sliding_window_view(P, len(weights), axis=-1) @ weights
+
+
+def _smooth(X, weights, left):
+    """
+    Series are extended by repeating their first and last values, 'left' samples before
+    and the rest of the kernel after each point
+    """
+    X = np.asarray(X, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    pad = [(0, 0)]*(X.ndim - 1) + [(left, len(weights) - 1 - left)]
+    return _correlate_valid(np.pad(X, pad, mode="edge"), weights)
+
+
+def linear_smoother(weights):
+    """
+    Centered weighted moving average, weights[len(weights)//2] is the weight of the point itself.
+    Returned smoother takes a series or 2-D batch of them (one per row)
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    return lambda X: _smooth(X, weights, len(weights)//2)
+
+
+def causal_smoother(weights):
+    """
+    Weighted moving average of the point and preceding ones, weights[0] is the weight of the point itself
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    return lambda X: _smooth(X, weights[::-1], len(weights) - 1)
+
+
+def gaussian_weights(half_width, variance):
+    W = np.exp(-np.square(np.arange(-half_width, half_width + 1))/(2*variance))
+    return W/np.sum(W)
+
+
+def savitzky_golay_smoother(window_length, polyorder):
+    """
+    Least squares fit of polynomial of 'polyorder' degree over centered odd window;
+    unlike averaging it keeps heights and widths of peaks
+    """
+    return linear_smoother(signal.savgol_coeffs(window_length, polyorder, use="dot"))
+
+
+def exponential_smoother(alpha, two_sided=False):
+    """
+    S[i] = alpha*X[i] + (1 - alpha)*S[i-1] started from the first value. Two-sided smoother
+    runs it forward and then backward, so peaks are not shifted
+    """
+    def exponential(X):
+        X = np.asarray(X, dtype=np.float64)
+        zi = (1 - alpha)*X[..., :1]
+        S = signal.lfilter([alpha], [1, alpha - 1], X, axis=-1, zi=zi)[0]
+        if two_sided:
+            S = exponential_smoother(alpha)(S[..., ::-1])[..., ::-1]
+        return S
+    return exponential
@@ -0,0 +1,174 @@
+import os
+import pickle
+import shutil
+
+import numpy as np
+
+from storage.records import as_comment
+
+
+COMMENT_STORE_FOLDER = "comments_store"
+
+ROOT_PARENT = -1
+MISSING_PARENT = -2
+
+
+class _ColumnWriter:
+    """
+    Appends values of one column to a raw file and turns it into .npy once the length is known
+    """
+
+    def __init__(self, path, dtype):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.length = 0
+        self._handle = open(path + ".raw", "wb")
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.dtype)
+        values.tofile(self._handle)
+        self.length += len(values)
+
+    def finish(self):
+        self._handle.close()
+        header = {"descr" : np.lib.format.dtype_to_descr(self.dtype), "fortran_order" : False,
+                  "shape" : (self.length,)}
+        with open(self.path, "wb") as handle, open(self.path + ".raw", "rb") as raw:
+            np.lib.format.write_array_header_1_0(handle, header)
+            shutil.copyfileobj(raw, handle)
+        os.remove(self.path + ".raw")
+
+
+class CommentStore:
+    """
+    On-disk columnar storage of posts with comments (full_data.pkl replacement).
+    Every column is a separate .npy file opened as read-only memory map on first access, so analyses
+    page in only the columns they touch and concurrent processes share the same pages.
+    Comments of post p are rows comment_offsets[p]:comment_offsets[p+1]. Parent index is the row of the
+    parent comment, ROOT_PARENT for replies to the post and MISSING_PARENT if parent was not scraped.
+    Comment text of row i is text_blob[text_offsets[i]:text_offsets[i+1]] encoded as utf-8.
+    """
+
+    _post_fields = ["post_ids", "post_author_ids", "comment_offsets"]
+    _comment_fields = ["comment_ids", "post_indexes", "parent_indexes", "user_ids", "ratings", "timestamps",
+                       "numbers_of_images", "text_offsets"]
+    _text_file = "text_blob.bin"
+    _strings_file = "strings.pkl"
+
+    def __init__(self, folder=COMMENT_STORE_FOLDER, mmap_mode="r"):
+        self.folder = folder
+        self.mmap_mode = mmap_mode
+        self._columns = {}
+        self._text_blob = None
+        with open(os.path.join(folder, self._strings_file), "rb") as handle:
+            strings = pickle.load(handle)
+        self.users = strings["users"]
+        self.links = strings["links"]
+        self._user_to_id = {user: i for i, user in enumerate(self.users)}
+
+    def __getattr__(self, name):
+        if name in CommentStore._post_fields or name in CommentStore._comment_fields:
+            columns = self.__dict__["_columns"]
+            if name not in columns:
+                columns[name] = np.load(os.path.join(self.folder, name + ".npy"), mmap_mode=self.mmap_mode)
+            return columns[name]
+        raise AttributeError(name)
+
+    @classmethod
+    def write(cls, records, folder=COMMENT_STORE_FOLDER):
+        """
+        :param records: Iterable of (post_id, post_dict) pairs with "comments" lists of Comment records
+                        (or legacy comment dictionaries), e.g. a stream of shard records.
+                        Columns are appended to files post by post, so only vocabularies stay in memory
+        """
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        users, user_to_id = [], {}
+
+        def intern_user(user):
+            if user not in user_to_id:
+                user_to_id[user] = len(users)
+                users.append(user)
+            return user_to_id[user]
+
+        columns = {name : _ColumnWriter(os.path.join(folder, name + ".npy"), dtype) for name, dtype in [
+            ("post_ids", np.int64), ("post_author_ids", np.int32), ("comment_offsets", np.int64),
+            ("comment_ids", np.int64), ("post_indexes", np.int32), ("parent_indexes", np.int64),
+            ("user_ids", np.int32), ("ratings", np.int32), ("timestamps", np.int64),
+            ("numbers_of_images", np.int16), ("text_offsets", np.int64)]}
+        links = []
+        number_of_comments, text_length = 0, 0
+        columns["comment_offsets"].extend([0])
+        columns["text_offsets"].extend([0])
+
+        with open(os.path.join(folder, cls._text_file), "wb") as text_handle:
+            for post_idx, (post_id, record) in enumerate(records):
+                columns["post_ids"].extend([post_id])
+                columns["post_author_ids"].extend([intern_user(record["author"])])
+                links.append(record.get("link"))
+
+                comments = [as_comment(comment) for comment in record["comments"]]
+                row_by_comment_id = {comment.id : number_of_comments + i for i, comment in enumerate(comments)}
+                texts = [comment.text.encode("utf-8") for comment in comments]
+                for text in texts:
+                    text_handle.write(text)
+
+                columns["comment_ids"].extend([comment.id for comment in comments])
+                columns["post_indexes"].extend([post_idx]*len(comments))
+                columns["parent_indexes"].extend([
+                    ROOT_PARENT if comment.parent == 0 else row_by_comment_id.get(comment.parent, MISSING_PARENT)
+                    for comment in comments])
+                columns["user_ids"].extend([intern_user(comment.user) for comment in comments])
+                columns["ratings"].extend([comment.rating for comment in comments])
+                columns["timestamps"].extend([comment.timestamp for comment in comments])
+                columns["numbers_of_images"].extend([comment.number_of_images for comment in comments])
+                columns["text_offsets"].extend(text_length + np.cumsum([len(text) for text in texts], dtype=np.int64))
+                text_length += sum(len(text) for text in texts)
+                number_of_comments += len(comments)
+                columns["comment_offsets"].extend([number_of_comments])
+
+        for column in columns.values():
+            column.finish()
+        with open(os.path.join(folder, cls._strings_file), "wb") as handle:
+            pickle.dump({"users" : users, "links" : links}, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+        return cls(folder)
+
+    @property
+    def number_of_posts(self):
+        return len(self.post_ids)
+
+    @property
+    def number_of_comments(self):
+        return len(self.user_ids)
+
+    def user_id(self, user):
+        return self._user_to_id.get(user, -1)
+
+    def post_comment_rows(self, post_idx):
+        return range(self.comment_offsets[post_idx], self.comment_offsets[post_idx + 1])
+
+    def post_author(self, post_idx):
+        return self.users[self.post_author_ids[post_idx]]
+
+    def comment_user(self, row):
+        return self.users[self.user_ids[row]]
+
+    def text(self, row):
+        if self._text_blob is None:
+            path = os.path.join(self.folder, self._text_file)
+            if os.path.getsize(path) == 0:
+                return ""
+            self._text_blob = np.memmap(path, dtype=np.uint8, mode="r")
+        return bytes(self._text_blob[self.text_offsets[row]:self.text_offsets[row + 1]]).decode("utf-8")
+
+
+def open_comment_store(folder=COMMENT_STORE_FOLDER, pickle_file="full_data.pkl"):
+    """
+    Opens comment store, converting legacy pickled dictionary on the first run
+    """
+    if os.path.exists(folder):
+        return CommentStore(folder)
+    with open(pickle_file, "rb") as handle:
+        return CommentStore.write(pickle.load(handle).items(), folder)
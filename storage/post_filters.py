@@ -0,0 +1,176 @@
+import numpy as np
+
+
+class PostFilter:
+    """
+    Declarative filter over PostStore. Filters are compiled to array operations: 'mask' evaluates
+    filter over all posts, 'matches' only over given post indexes. Filters are combined with '&'
+    """
+
+    def mask(self, posts):
+        """
+        :return: Boolean mask of matching posts
+        """
+        return self.matches(posts, np.arange(len(posts)))
+
+    def matches(self, posts, idxes):
+        """
+        :return: Boolean mask of matching posts among 'idxes'
+        """
+        raise NotImplementedError()
+
+    def indexes(self, posts):
+        """
+        :return: Indexes of matching posts (in any order) if filter is answered by an index
+        without scanning every post, None otherwise
+        """
+        return None
+
+    def __and__(self, other):
+        return AllOf(self, other)
+
+
+class _PostingFilter(PostFilter):
+    """
+    Filter answered by inverted tag index
+    """
+
+    def postings(self, posts):
+        """
+        :return: Sorted indexes of matching posts
+        """
+        raise NotImplementedError()
+
+    def mask(self, posts):
+        mask = np.zeros(len(posts), dtype=bool)
+        mask[self.postings(posts)] = True
+        return mask
+
+    def matches(self, posts, idxes):
+        return np.isin(idxes, self.postings(posts))
+
+    def indexes(self, posts):
+        return self.postings(posts)
+
+
+class TagAny(_PostingFilter):
+    """
+    Posts having at least one of the tags
+    """
+
+    def __init__(self, tags):
+        self.tags = {tags} if type(tags) is str else set(tags)
+
+    def postings(self, posts):
+        return posts.tag_posts(self.tags)
+
+
+class TagAll(_PostingFilter):
+    """
+    Posts having every one of the tags
+    """
+
+    def __init__(self, tags):
+        self.tags = {tags} if type(tags) is str else set(tags)
+
+    def postings(self, posts):
+        return posts.tag_posts_all(self.tags)
+
+
+class TimeRange(PostFilter):
+    """
+    Posts with begin <= timestamp < end, None bounds are open
+    """
+
+    def __init__(self, begin=None, end=None):
+        self.begin = begin
+        self.end = end
+
+    def mask(self, posts):
+        mask = np.zeros(len(posts), dtype=bool)
+        mask[self.indexes(posts)] = True
+        return mask
+
+    def indexes(self, posts):
+        return posts.time_range_posts(self.begin, self.end)
+
+    def matches(self, posts, idxes):
+        return _in_range(posts.timestamps[idxes], self.begin, self.end)
+
+
+class RatingRange(PostFilter):
+    """
+    Posts with low <= rating < high, None bounds are open
+    """
+
+    def __init__(self, low=None, high=None):
+        self.low = low
+        self.high = high
+
+    def matches(self, posts, idxes):
+        return _in_range(posts.ratings[idxes], self.low, self.high)
+
+
+class Author(PostFilter):
+
+    def __init__(self, author):
+        self.author = author
+
+    def matches(self, posts, idxes):
+        author_id = posts.author_id(self.author)
+        if author_id < 0:
+            return np.zeros(len(idxes), dtype=bool)
+        return posts.author_ids[idxes] == author_id
+
+
+class AllOf(PostFilter):
+    """
+    Posts matching every filter. Tag filters are intersected as posting lists first,
+    then the rest is checked only on posts they left
+    """
+
+    def __init__(self, *filters):
+        self.filters = []
+        for post_filter in filters:
+            self.filters.extend(post_filter.filters if isinstance(post_filter, AllOf) else [post_filter])
+
+    def _split(self):
+        posting_filters = [f for f in self.filters if isinstance(f, _PostingFilter)]
+        return posting_filters, [f for f in self.filters if not isinstance(f, _PostingFilter)]
+
+    def indexes(self, posts):
+        posting_filters, other_filters = self._split()
+        if not posting_filters:
+            return None
+        idxes = posting_filters[0].postings(posts)
+        for post_filter in posting_filters[1:]:
+            idxes = np.intersect1d(idxes, post_filter.postings(posts), assume_unique=True)
+        for post_filter in other_filters:
+            idxes = idxes[post_filter.matches(posts, idxes)]
+        return idxes
+
+    def mask(self, posts):
+        idxes = self.indexes(posts)
+        if idxes is None:
+            mask = np.ones(len(posts), dtype=bool)
+            for post_filter in self.filters:
+                mask &= post_filter.mask(posts)
+            return mask
+        mask = np.zeros(len(posts), dtype=bool)
+        mask[idxes] = True
+        return mask
+
+    def matches(self, posts, idxes):
+        result = np.ones(len(idxes), dtype=bool)
+        for post_filter in self.filters:
+            result &= post_filter.matches(posts, idxes)
+        return result
+
+
+def _in_range(values, low, high):
+    result = np.ones(len(values), dtype=bool)
+    if low is not None:
+        result &= values >= low
+    if high is not None:
+        result &= values < high
+    return result
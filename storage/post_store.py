@@ -0,0 +1,344 @@
+from array import array
+import hashlib
+import os
+import pickle
+
+import numpy as np
+from scipy import sparse
+
+
+POST_STORE_FOLDER = "data_store"
+
+
+class PostStore:
+    """
+    Columnar storage of scraped posts: one numpy array per numeric field plus CSR-style tags
+    (tags of post i are tag_ids[tag_offsets[i]:tag_offsets[i+1]], indexes into 'tags' vocabulary).
+    Authors are stored as indexes into 'authors' vocabulary. Titles and links are kept as plain lists.
+    Inverted tag index is built on first tag query and saved with the store: sorted indexes of posts
+    having tag t are tag_postings[tag_posting_offsets[t]:tag_posting_offsets[t+1]].
+    Sort index is built the same way: time_order and rating_order are post indexes stably sorted
+    by timestamp and by descending rating, time_rank and rating_rank are positions of posts in them.
+    Tag frequency table is tag ids sorted by number of occurrences (tags_by_frequency) along with
+    those numbers (tag_frequencies), so any threshold query is a binary search.
+    Version is a hash of the content, it is saved with the store and keys caches derived from it.
+    """
+
+    _array_fields = ["ids", "timestamps", "ratings", "comments_numbers", "author_ids", "tag_offsets", "tag_ids"]
+    _tag_index_fields = ["tag_postings", "tag_posting_offsets"]
+    _sort_index_fields = ["time_order", "rating_order", "time_rank", "rating_rank"]
+    _tag_frequency_fields = ["tags_by_frequency", "tag_frequencies"]
+    _strings_file = "strings.pkl"
+    _version_file = "version.txt"
+
+    def __init__(self, ids, timestamps, ratings, comments_numbers, author_ids, tag_offsets, tag_ids,
+                 authors, tags, titles, links, tag_postings=None, tag_posting_offsets=None,
+                 time_order=None, rating_order=None, time_rank=None, rating_rank=None,
+                 tags_by_frequency=None, tag_frequencies=None, version=None):
+        self.ids = ids
+        self.timestamps = timestamps
+        self.ratings = ratings
+        self.comments_numbers = comments_numbers
+        self.author_ids = author_ids
+        self.tag_offsets = tag_offsets
+        self.tag_ids = tag_ids
+        self.authors = authors
+        self.tags = tags
+        self.titles = titles
+        self.links = links
+        self.tag_postings = tag_postings
+        self.tag_posting_offsets = tag_posting_offsets
+        self.time_order = time_order
+        self.rating_order = rating_order
+        self.time_rank = time_rank
+        self.rating_rank = rating_rank
+        self.tags_by_frequency = tags_by_frequency
+        self.tag_frequencies = tag_frequencies
+        self._version = version
+        self._tag_to_id = {tag: i for i, tag in enumerate(tags)}
+        self._author_to_id = {author: i for i, author in enumerate(authors)}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        :param data: Dictionary {post_id: post_dict} as produced by PikabuSpider
+        """
+        return cls.from_records(data.items())
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        :param records: Iterable of (post_id, post_dict) pairs, e.g. a stream of shard records;
+                        numeric fields are accumulated in compact arrays, so the stream is never materialized
+        """
+        ids, timestamps, ratings, tag_offsets = array("q"), array("q"), array("q"), array("q", [0])
+        comments_numbers, author_ids, tag_ids = array("l"), array("l"), array("l")
+        authors, author_to_id = [], {}
+        tags, tag_to_id = [], {}
+        titles, links = [], []
+
+        for post_id, post in records:
+            ids.append(post_id)
+            timestamps.append(post["timestamp"])
+            ratings.append(post["rating"])
+            comments_numbers.append(post["comments_number"])
+            author = post["author"]
+            if author not in author_to_id:
+                author_to_id[author] = len(authors)
+                authors.append(author)
+            author_ids.append(author_to_id[author])
+            for tag in post["tags"]:
+                if tag not in tag_to_id:
+                    tag_to_id[tag] = len(tags)
+                    tags.append(tag)
+                tag_ids.append(tag_to_id[tag])
+            tag_offsets.append(len(tag_ids))
+            titles.append(post.get("title"))
+            links.append(post.get("link"))
+
+        def column(values, dtype):
+            return np.frombuffer(values, dtype=values.typecode).astype(dtype) if len(values) else np.empty(0, dtype)
+
+        return cls(column(ids, np.int64), column(timestamps, np.int64), column(ratings, np.int64),
+                   column(comments_numbers, np.int32), column(author_ids, np.int32), column(tag_offsets, np.int64),
+                   column(tag_ids, np.int32), authors, tags, titles, links)
+
+    @classmethod
+    def load(cls, folder=POST_STORE_FOLDER, mmap_mode=None):
+        arrays = {field: np.load(os.path.join(folder, field + ".npy"), mmap_mode=mmap_mode)
+                  for field in cls._array_fields}
+        for field in cls._tag_index_fields + cls._sort_index_fields + cls._tag_frequency_fields:
+            path = os.path.join(folder, field + ".npy")
+            if os.path.exists(path):
+                arrays[field] = np.load(path, mmap_mode=mmap_mode)
+        with open(os.path.join(folder, cls._strings_file), "rb") as handle:
+            strings = pickle.load(handle)
+        version_path = os.path.join(folder, cls._version_file)
+        if os.path.exists(version_path):
+            with open(version_path, "r") as handle:
+                arrays["version"] = handle.read().strip()
+        return cls(authors=strings["authors"], tags=strings["tags"],
+                   titles=strings["titles"], links=strings["links"], **arrays)
+
+    def save(self, folder=POST_STORE_FOLDER):
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self._ensure_tag_index()
+        self._ensure_sort_index()
+        self._ensure_tag_frequencies()
+        for field in self._array_fields + self._tag_index_fields + self._sort_index_fields + self._tag_frequency_fields:
+            np.save(os.path.join(folder, field + ".npy"), getattr(self, field))
+        strings = {
+            "authors" : self.authors,
+            "tags" : self.tags,
+            "titles" : self.titles,
+            "links" : self.links,
+        }
+        with open(os.path.join(folder, self._strings_file), "wb") as handle:
+            pickle.dump(strings, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(os.path.join(folder, self._version_file), "w") as handle:
+            handle.write(self.version)
+
+    @property
+    def version(self):
+        if self._version is None:
+            content = hashlib.sha1()
+            for field in self._array_fields:
+                content.update(np.ascontiguousarray(getattr(self, field)).tobytes())
+            content.update("\n".join(self.tags).encode("utf-8"))
+            self._version = content.hexdigest()[:16]
+        return self._version
+
+    def __len__(self):
+        return len(self.ids)
+
+    def tag_id(self, tag):
+        return self._tag_to_id.get(tag, -1)
+
+    def author_id(self, author):
+        return self._author_to_id.get(author, -1)
+
+    def post_tag_ids(self, idx):
+        return self.tag_ids[self.tag_offsets[idx]:self.tag_offsets[idx + 1]]
+
+    def post_tags(self, idx):
+        return [self.tags[tag_id] for tag_id in self.post_tag_ids(idx)]
+
+    def tag_post_indexes(self):
+        """
+        :return: Post index for every entry of 'tag_ids'
+        """
+        return np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.tag_offsets))
+
+    def _ensure_tag_index(self):
+        if self.tag_postings is not None:
+            return
+        post_indexes = self.tag_post_indexes()
+        order = np.lexsort((post_indexes, self.tag_ids))
+        tag_ids, post_indexes = self.tag_ids[order], post_indexes[order]
+        # Same tag may be repeated within one post
+        unique = np.ones(len(tag_ids), dtype=bool)
+        unique[1:] = (tag_ids[1:] != tag_ids[:-1]) | (post_indexes[1:] != post_indexes[:-1])
+        tag_ids, post_indexes = tag_ids[unique], post_indexes[unique]
+        self.tag_postings = post_indexes
+        self.tag_posting_offsets = np.zeros(len(self.tags) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(tag_ids, minlength=len(self.tags)), out=self.tag_posting_offsets[1:])
+
+    def tag_posts(self, tag_group):
+        """
+        :param tag_group: Tag or iterable of tags
+        :return: Sorted indexes of posts having at least one tag of the group
+        """
+        self._ensure_tag_index()
+        if type(tag_group) is str:
+            tag_group = {tag_group}
+        postings = []
+        for tag in tag_group:
+            tag_id = self.tag_id(tag)
+            if tag_id >= 0:
+                postings.append(self.tag_postings[self.tag_posting_offsets[tag_id]:self.tag_posting_offsets[tag_id + 1]])
+        if not postings:
+            return np.zeros(0, dtype=np.int64)
+        if len(postings) == 1:
+            return np.asarray(postings[0])
+        return np.unique(np.concatenate(postings))
+
+    def tag_posts_all(self, tags):
+        """
+        :param tags: Iterable of tags
+        :return: Sorted indexes of posts having every tag
+        """
+        self._ensure_tag_index()
+        result = None
+        for tag in tags:
+            tag_id = self.tag_id(tag)
+            if tag_id < 0:
+                return np.zeros(0, dtype=np.int64)
+            postings = self.tag_postings[self.tag_posting_offsets[tag_id]:self.tag_posting_offsets[tag_id + 1]]
+            result = np.asarray(postings) if result is None else np.intersect1d(result, postings, assume_unique=True)
+        return np.arange(len(self)) if result is None else result
+
+    def tag_incidence(self, tags):
+        """
+        :param tags: List of tags
+        :return: Sparse binary post x tag matrix (scipy CSC), column j marks posts having tags[j]
+        """
+        self._ensure_tag_index()
+        postings = []
+        for tag in tags:
+            tag_id = self.tag_id(tag)
+            if tag_id >= 0:
+                postings.append(self.tag_postings[self.tag_posting_offsets[tag_id]:self.tag_posting_offsets[tag_id + 1]])
+            else:
+                postings.append(np.zeros(0, dtype=np.int64))
+        indptr = np.zeros(len(tags) + 1, dtype=np.int64)
+        np.cumsum([len(posting) for posting in postings], out=indptr[1:])
+        indices = np.concatenate(postings) if postings else np.zeros(0, dtype=np.int64)
+        return sparse.csc_matrix((np.ones(len(indices), dtype=np.int64), indices, indptr), shape=(len(self), len(tags)))
+
+    def tag_mask(self, tag_group):
+        """
+        :param tag_group: Tag or iterable of tags
+        :return: Boolean mask of posts having at least one tag of the group
+        """
+        mask = np.zeros(len(self), dtype=bool)
+        mask[self.tag_posts(tag_group)] = True
+        return mask
+
+    def _ensure_sort_index(self):
+        if self.time_order is not None:
+            return
+        self.time_order = np.argsort(self.timestamps, kind="stable")
+        self.rating_order = np.argsort(-np.asarray(self.ratings), kind="stable")
+        self.time_rank, self.rating_rank = [_inverse_permutation(order) for order in [self.time_order, self.rating_order]]
+
+    @staticmethod
+    def _select_sorted(order, rank, selection):
+        """
+        Mask is applied along the whole order, selected indexes are sorted by their ranks
+        """
+        if selection is None:
+            return order
+        selection = np.asarray(selection)
+        if selection.dtype == bool:
+            return order[selection[order]]
+        return selection[np.argsort(rank[selection])]
+
+    def posts_by_time(self, selection=None):
+        """
+        :param selection: Boolean mask or indexes of posts, None means all posts
+        :return: Indexes of selected posts sorted by time (stable)
+        """
+        self._ensure_sort_index()
+        return self._select_sorted(self.time_order, self.time_rank, selection)
+
+    def posts_by_rating(self, selection=None):
+        """
+        :param selection: Boolean mask or indexes of posts, None means all posts
+        :return: Indexes of selected posts sorted by descending rating (stable)
+        """
+        self._ensure_sort_index()
+        return self._select_sorted(self.rating_order, self.rating_rank, selection)
+
+    def time_range_posts(self, begin=None, end=None):
+        """
+        :return: Indexes of posts with begin <= timestamp < end sorted by time
+        """
+        self._ensure_sort_index()
+        lo = 0 if begin is None else np.searchsorted(self.timestamps, begin, side="left", sorter=self.time_order)
+        hi = len(self) if end is None else np.searchsorted(self.timestamps, end, side="left", sorter=self.time_order)
+        return self.time_order[lo:hi]
+
+    def _ensure_tag_frequencies(self):
+        if self.tags_by_frequency is not None:
+            return
+        frequencies = np.bincount(self.tag_ids, minlength=len(self.tags))
+        self.tags_by_frequency = np.argsort(frequencies, kind="stable").astype(np.int32)
+        self.tag_frequencies = frequencies[self.tags_by_frequency]
+
+    def tags_by_occurency_number(self, min_number=None, max_number=None):
+        """
+        :return: Ids of tags occurring from min_number to max_number times (both inclusive, None bounds are open)
+        """
+        self._ensure_tag_frequencies()
+        lo = 0 if min_number is None else np.searchsorted(self.tag_frequencies, min_number, side="left")
+        hi = len(self.tag_frequencies) if max_number is None else np.searchsorted(self.tag_frequencies, max_number, side="right")
+        return self.tags_by_frequency[lo:hi]
+
+    def record(self, idx):
+        return {
+            "title" : self.titles[idx],
+            "rating" : int(self.ratings[idx]),
+            "comments_number" : int(self.comments_numbers[idx]),
+            "tags" : self.post_tags(idx),
+            "timestamp" : int(self.timestamps[idx]),
+            "author" : self.authors[self.author_ids[idx]],
+            "link" : self.links[idx],
+        }
+
+    def to_dict(self):
+        return {int(post_id): self.record(idx) for idx, post_id in enumerate(self.ids)}
+
+
+def _inverse_permutation(order):
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return rank
+
+
+def as_post_store(data):
+    if isinstance(data, PostStore):
+        return data
+    return PostStore.from_dict(data)
+
+
+def load_posts(folder=POST_STORE_FOLDER, pickle_file="data.pkl"):
+    """
+    Loads columnar store if present, converts legacy pickled dictionary on the first run otherwise
+    """
+    if os.path.exists(folder):
+        return PostStore.load(folder)
+    with open(pickle_file, "rb") as handle:
+        posts = PostStore.from_dict(pickle.load(handle))
+    posts.save(folder)
+    return posts
@@ -0,0 +1,41 @@
+import datetime
+import sys
+from collections import namedtuple
+
+
+# Compact comment record: integer ids (0 parent means reply to the post), interned user name,
+# unix timestamp (-1 if unknown). Holds no references to parsed documents.
+Comment = namedtuple("Comment", ["id", "parent", "user", "rating", "timestamp", "text", "number_of_images"])
+
+
+def parse_comment_id(comment_id):
+    """
+    :param comment_id: 'comment_<n>', '<n>' or integer
+    """
+    if type(comment_id) is int:
+        return comment_id
+    return int(str(comment_id).replace("comment_", ""))
+
+
+def parse_comment_timestamp(timestamp):
+    if type(timestamp) is int:
+        return timestamp
+    try:
+        return int(datetime.datetime.fromisoformat(timestamp).timestamp())
+    except (TypeError, ValueError):
+        return -1
+
+
+def make_comment(id, parent, user, rating, timestamp, text, number_of_images):
+    return Comment(parse_comment_id(id), parse_comment_id(parent), sys.intern(user), rating,
+                   parse_comment_timestamp(timestamp), text, number_of_images)
+
+
+def as_comment(comment):
+    """
+    Converts legacy comment dictionary to Comment, leaves Comment as is
+    """
+    if isinstance(comment, Comment):
+        return comment
+    return make_comment(comment["id"], comment["parent"], comment["user"], comment["rating"],
+                        comment["timestamp"], comment["text"], comment["number_of_images"])
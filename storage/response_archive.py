@@ -0,0 +1,66 @@
+import gzip
+import hashlib
+import json
+import os
+
+
+RESPONSE_ARCHIVE_FOLDER = "response_archive"
+INDEX_FILE = "index.jsonl"
+
+
+class ResponseArchive:
+    """
+    Content-addressed archive of raw responses: every distinct body is stored once, gzipped, under
+    objects/<sha1[:2]>/<sha1>.gz. Append-only index keeps one json line per archived response
+    (url, callback name, request meta, encoding and body hash) in crawl order.
+    """
+
+    def __init__(self, folder=RESPONSE_ARCHIVE_FOLDER):
+        self.folder = folder
+        self._index_handle = None
+
+    def _object_path(self, digest):
+        return os.path.join(self.folder, "objects", digest[:2], digest + ".gz")
+
+    def store(self, url, body, callback, meta=None, encoding="utf-8"):
+        digest = hashlib.sha1(body).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            tmp_path = path + ".tmp"
+            with gzip.open(tmp_path, "wb") as handle:
+                handle.write(body)
+            os.replace(tmp_path, path)
+        if self._index_handle is None:
+            self._index_handle = open(os.path.join(self.folder, INDEX_FILE), "a", encoding="utf-8")
+        entry = {
+            "url" : url,
+            "callback" : callback,
+            "meta" : meta or {},
+            "encoding" : encoding,
+            "sha1" : digest,
+        }
+        self._index_handle.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._index_handle.flush()
+        return digest
+
+    def load_body(self, digest):
+        with gzip.open(self._object_path(digest), "rb") as handle:
+            return handle.read()
+
+    def entries(self):
+        path = os.path.join(self.folder, INDEX_FILE)
+        if not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as handle:
+            for line in handle:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue # line torn by interruption
+
+    def close(self):
+        if self._index_handle is not None:
+            self._index_handle.close()
+            self._index_handle = None
@@ -0,0 +1,147 @@
+import datetime
+import json
+import os
+import pickle
+import warnings
+
+
+SHARDS_FOLDER = "shards"
+POSTS_KIND = "posts"
+FULL_KIND = "full"
+MANIFEST_FILE = "manifest.json"
+CRAWLED_DAYS_KEY = "crawled_days"
+
+
+def shard_day(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime("%Y-%m-%d")
+
+
+def _shard_path(folder, kind, day):
+    return os.path.join(folder, kind, day + ".pkl")
+
+
+class ShardWriter:
+    """
+    Appends (post_id, record) pairs to per-day shard files as a stream of pickles, so nothing
+    but currently open file handles and per-day counters is kept in memory.
+    Manifest {kind: {day: number_of_records}} is rewritten whenever a new shard is opened and on close.
+    Manifest also keeps date index {CRAWLED_DAYS_KEY: {listing_day: date_of_last_crawl}}.
+    Record None is a tombstone removing earlier records of the post.
+    """
+
+    def __init__(self, folder=SHARDS_FOLDER, max_open_shards=16):
+        self.folder = folder
+        self.max_open_shards = max_open_shards
+        self.manifest = read_manifest(folder)
+        self._handles = {}
+
+    def _get_handle(self, kind, day):
+        key = (kind, day)
+        if key in self._handles:
+            handle = self._handles.pop(key)
+        else:
+            if len(self._handles) >= self.max_open_shards:
+                oldest_key = next(iter(self._handles))
+                self._handles.pop(oldest_key).close()
+            path = _shard_path(self.folder, kind, day)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            handle = open(path, "ab")
+            if day not in self.manifest.setdefault(kind, {}):
+                self.manifest[kind][day] = 0
+                self._write_manifest()
+        self._handles[key] = handle # reinserted as the most recently used
+        return handle
+
+    def append(self, kind, day, post_id, record):
+        handle = self._get_handle(kind, day)
+        pickle.dump((post_id, record), handle, protocol=pickle.HIGHEST_PROTOCOL)
+        handle.flush()
+        self.manifest[kind][day] += 1
+
+    def mark_day_crawled(self, day, crawl_date):
+        crawled_days = self.manifest.setdefault(CRAWLED_DAYS_KEY, {})
+        if crawled_days.get(day) != crawl_date:
+            crawled_days[day] = crawl_date
+            self._write_manifest()
+
+    def close(self):
+        for handle in self._handles.values():
+            handle.close()
+        self._handles = {}
+        self._write_manifest()
+
+    def _write_manifest(self):
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        tmp_path = os.path.join(self.folder, MANIFEST_FILE + ".tmp")
+        with open(tmp_path, "w") as fp:
+            json.dump(self.manifest, fp, indent=4, sort_keys=True)
+        os.replace(tmp_path, os.path.join(self.folder, MANIFEST_FILE))
+
+
+def read_manifest(folder=SHARDS_FOLDER):
+    path = os.path.join(folder, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as fp:
+        return json.load(fp)
+
+
+def read_crawled_days(folder=SHARDS_FOLDER):
+    """
+    :return: Dictionary {listing_day: date_of_last_crawl} with ISO formatted dates
+    """
+    return read_manifest(folder).get(CRAWLED_DAYS_KEY, {})
+
+
+def shard_days(folder=SHARDS_FOLDER, kind=POSTS_KIND):
+    kind_folder = os.path.join(folder, kind)
+    if not os.path.exists(kind_folder):
+        return []
+    return sorted(file[:-len(".pkl")] for file in os.listdir(kind_folder) if file.endswith(".pkl"))
+
+
+def iterate_shard(path):
+    with open(path, "rb") as handle:
+        while True:
+            try:
+                yield pickle.load(handle)
+            except EOFError:
+                return
+            except pickle.UnpicklingError:
+                warnings.warn("Shard {} ends with truncated record, skipping it".format(path), RuntimeWarning)
+                return
+
+
+def iterate_shards(folder=SHARDS_FOLDER, kind=POSTS_KIND, days=None):
+    """
+    Lazily yields (post_id, record) pairs of all shards of given kind in day order.
+    Later records of the same post come later, so dict(iterate_shards(...)) keeps the freshest ones
+    """
+    for day in shard_days(folder, kind) if days is None else days:
+        path = _shard_path(folder, kind, day)
+        if os.path.exists(path):
+            yield from iterate_shard(path)
+
+
+def iterate_shard_records(folder=SHARDS_FOLDER, kind=POSTS_KIND):
+    """
+    Yields (post_id, freshest record) pairs in day order with tombstoned posts removed.
+    All records of a post are in the shard of its day, so only one day of records is held in memory
+    """
+    for day in shard_days(folder, kind):
+        records = {}
+        for post_id, record in iterate_shard(_shard_path(folder, kind, day)):
+            if record is None:
+                records.pop(post_id, None)
+            else:
+                records[post_id] = record
+        yield from records.items()
+
+
+def read_shard_records(folder=SHARDS_FOLDER, kind=POSTS_KIND):
+    """
+    :return: Dictionary {post_id: freshest record} with tombstoned posts removed
+    """
+    return dict(iterate_shard_records(folder, kind))
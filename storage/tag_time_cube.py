@@ -0,0 +1,131 @@
+import os
+
+import numpy as np
+from scipy import sparse
+
+
+TAG_TIME_CUBE_FOLDER = "tag_time_cube"
+
+
+class TagTimeCube:
+    """
+    Sparse tag x time bucket matrices of post counts and rating sums (a post with several tags is counted
+    in every tag row). Buckets are 'resolution' seconds wide starting from 'origin'.
+    Density of a tag is its row re-binned into the requested bins. Buckets falling into a single bin
+    are added whole; buckets split between bins (bin width is not a multiple of the resolution or the
+    window does not begin on a bucket edge) are counted exactly from the posts they hold, found by
+    time index lookups, so any grid is served from the cube.
+    Rows of multi-tag groups are built from posting list union (posts having several tags of the group
+    are counted once) and kept in memory.
+    """
+
+    def __init__(self, counts, rating_sums, origin, resolution, posts):
+        self.counts = counts
+        self.rating_sums = rating_sums
+        self.origin = origin
+        self.resolution = resolution
+        self.posts = posts
+        self._group_rows = {}
+
+    @classmethod
+    def build(cls, posts, resolution=60*60):
+        posts._ensure_tag_index()
+        origin = int(np.min(posts.timestamps)) // resolution * resolution if len(posts) else 0
+        buckets = (np.asarray(posts.timestamps) - origin) // resolution
+        number_of_buckets = int(np.max(buckets)) + 1 if len(posts) else 0
+        tag_ids = np.repeat(np.arange(len(posts.tags)), np.diff(posts.tag_posting_offsets))
+        shape = (len(posts.tags), number_of_buckets)
+        post_indexes = posts.tag_postings
+        counts = sparse.csr_matrix((np.ones(len(post_indexes), dtype=np.int64), (tag_ids, buckets[post_indexes])), shape=shape)
+        rating_sums = sparse.csr_matrix((np.asarray(posts.ratings, dtype=np.int64)[post_indexes], (tag_ids, buckets[post_indexes])), shape=shape)
+        return cls(counts, rating_sums, origin, resolution, posts)
+
+    @classmethod
+    def cached(cls, posts, resolution=60*60, folder=TAG_TIME_CUBE_FOLDER):
+        """
+        Loads cube of this version of posts or builds and saves it
+        """
+        path = os.path.join(folder, "{}_{}.npz".format(posts.version, resolution))
+        if os.path.exists(path):
+            arrays = np.load(path)
+            shape = tuple(arrays["shape"])
+            counts, rating_sums = [sparse.csr_matrix((arrays[name + "_data"], arrays[name + "_indices"], arrays[name + "_indptr"]), shape=shape)
+                                   for name in ["counts", "rating_sums"]]
+            return cls(counts, rating_sums, int(arrays["origin"]), resolution, posts)
+        cube = cls.build(posts, resolution)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        arrays = {}
+        for name, matrix in [("counts", cube.counts), ("rating_sums", cube.rating_sums)]:
+            arrays.update({name + "_data" : matrix.data, name + "_indices" : matrix.indices, name + "_indptr" : matrix.indptr})
+        np.savez(path, shape=np.asarray(cube.counts.shape), origin=cube.origin, **arrays)
+        return cube
+
+    def group_rows(self, tag_group):
+        """
+        :param tag_group: Tag or iterable of tags
+        :return: Dense count and rating sum rows of posts having at least one tag of the group
+        """
+        if type(tag_group) is str:
+            tag_group = {tag_group}
+        key = frozenset(tag_group)
+        if key not in self._group_rows:
+            tag_ids = [self.posts.tag_id(tag) for tag in key if self.posts.tag_id(tag) >= 0]
+            if len(tag_ids) == 1:
+                counts = self.counts[tag_ids[0]].toarray().ravel()
+                rating_sums = self.rating_sums[tag_ids[0]].toarray().ravel()
+            else:
+                post_indexes = self.posts.tag_posts(key)
+                buckets = (np.asarray(self.posts.timestamps)[post_indexes] - self.origin) // self.resolution
+                counts = np.bincount(buckets, minlength=self.counts.shape[1])
+                rating_sums = np.bincount(buckets, weights=np.asarray(self.posts.ratings)[post_indexes], minlength=self.counts.shape[1])
+            self._group_rows[key] = (counts, rating_sums)
+        return self._group_rows[key]
+
+    def _bucket_posts(self, tag_group, buckets):
+        """
+        :return: Indexes of posts of the group with timestamps in given buckets
+        """
+        posts = self.posts
+        posts._ensure_sort_index()
+        starts = self.origin + buckets*self.resolution
+        lo = np.searchsorted(posts.timestamps, starts, side="left", sorter=posts.time_order)
+        hi = np.searchsorted(posts.timestamps, starts + self.resolution, side="left", sorter=posts.time_order)
+        candidates = np.concatenate([posts.time_order[l:h] for l, h in zip(lo, hi)])
+        group = posts.tag_posts(tag_group)
+        positions = np.minimum(np.searchsorted(group, candidates), len(group) - 1)
+        return candidates[group[positions] == candidates]
+
+    def rebin(self, tag_group, begin_time, end_time, discretizing_divisor):
+        """
+        Same binning as utils.discretize: bins of discretizing_divisor seconds from begin_time,
+        posts out of [begin_time, end_time] go to the first and the last bins
+        :return: Post counts and rating sums per bin
+        """
+        bins = int(float(end_time - begin_time)//discretizing_divisor + 1)
+
+        def bin_of(timestamps):
+            return np.clip((timestamps - begin_time)//discretizing_divisor, 0, bins - 1).astype(np.intp)
+
+        counts, rating_sums = self.group_rows(tag_group)
+        starts = self.origin + np.arange(len(counts), dtype=np.int64)*self.resolution
+        # Timestamps are whole seconds, so the last one a bucket can hold is its end minus one
+        first_bins, last_bins = bin_of(starts), bin_of(starts + self.resolution - 1)
+        whole = first_bins == last_bins
+        bin_counts = np.bincount(first_bins[whole], weights=counts[whole], minlength=bins)
+        bin_rating_sums = np.bincount(first_bins[whole], weights=rating_sums[whole], minlength=bins)
+        split = np.flatnonzero(~whole & (counts > 0))
+        if len(split):
+            post_indexes = self._bucket_posts(tag_group, split)
+            bin_n = bin_of(np.asarray(self.posts.timestamps)[post_indexes])
+            bin_counts += np.bincount(bin_n, minlength=bins)
+            bin_rating_sums += np.bincount(bin_n, weights=np.asarray(self.posts.ratings)[post_indexes], minlength=bins)
+        return bin_counts, bin_rating_sums
+
+    def normalized_density(self, tag_group, begin_time, end_time, discretizing_divisor):
+        """
+        :return: Share of posts of the group per bin, None if group has no posts
+        """
+        counts, _ = self.rebin(tag_group, begin_time, end_time, discretizing_divisor)
+        total = np.sum(counts)
+        return counts/total if total > 0 else None
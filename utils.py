@@ -4,7 +4,7 @@ import os
 import warnings
 
 import numpy as np
-from performance.caching import save_code_based_cache
+from storage.post_filters import PostFilter
 
 
 def clean_folders(folders):
@@ -27,65 +27,158 @@ def timestamp_to_date(timestamp):
     return datetime.datetime.fromtimestamp(timestamp).strftime('%d-%m-%Y')
 
 
-def discretize(X, Y=None, bins=None, discretizing_divisor=None, begin_x=None, end_x=None, normalize=True):
-    if begin_x is None:
-        begin_x = np.min(X)
-    if end_x is None:
-        end_x = np.max(X)
+def _discretizing_grid(begin_x, end_x, bins, discretizing_divisor):
+    """
+    :return: Number of bins and bin width
+    """
     if bins is not None:
         discretizing_divisor = float(end_x-begin_x)//bins + 1
     elif discretizing_divisor is not None:
         bins = float(end_x-begin_x)//discretizing_divisor + 1
     else:
         raise RuntimeError("Bins or discretizing divisor should be provided")
+    return int(bins), discretizing_divisor
+
+
+def _bin_numbers(X, begin_x, discretizing_divisor, bins):
+    """
+    Out of range values go to the first and the last bins
+    """
+    bin_n = (np.asarray(X) - begin_x) // discretizing_divisor
+    return np.clip(bin_n, 0, bins - 1).astype(np.intp)
+
 
-    X_discretized = np.zeros(bins)
+def discretize(X, Y=None, bins=None, discretizing_divisor=None, begin_x=None, end_x=None, normalize=True):
+    if begin_x is None:
+        begin_x = np.min(X)
+    if end_x is None:
+        end_x = np.max(X)
+    bins, discretizing_divisor = _discretizing_grid(begin_x, end_x, bins, discretizing_divisor)
+
+    bin_n = _bin_numbers(X, begin_x, discretizing_divisor, bins)
+    X_discretized = np.bincount(bin_n, minlength=bins).astype(np.float64)
     if Y is None:
-        for x in X:
-            bin_n = (x - begin_x) // discretizing_divisor
-            if bin_n < 0: bin_n = 0
-            if bin_n >= bins: bin_n = bins - 1
-            X_discretized[bin_n] += 1
         if normalize: X_discretized /= len(X)
         return X_discretized
     else:
-        Y_discretized = np.zeros(bins)
-        for x, y in zip(X, Y):
-            bin_n = (x - begin_x) // discretizing_divisor
-            if bin_n < 0: bin_n = 0
-            if bin_n >= bins: bin_n = bins - 1
-            X_discretized[bin_n] += 1
-            Y_discretized[bin_n] += y
-        for i in range(len(Y_discretized)):
-            if X_discretized[i] > 0:
-                Y_discretized[i] /= X_discretized[i]
+        Y_discretized = np.bincount(bin_n, weights=np.asarray(Y, dtype=np.float64), minlength=bins)
+        np.divide(Y_discretized, X_discretized, out=Y_discretized, where=X_discretized > 0)
         if normalize: X_discretized /= len(X)
         return X_discretized, Y_discretized
 
 
-def extract_rating_by_time(raw_data, filter_function):
-    TR = [(v["timestamp"], v["rating"]) for v in raw_data.values() if filter_function(v)]
-    if not TR:
+def discretize_batch(X_series, Y_series=None, bins=None, discretizing_divisor=None, begin_x=None, end_x=None, normalize=True):
+    """
+    Same as discretize for every series, but all series share one grid (by default from minimum
+    to maximum over all of them) and are histogrammed in a single call
+    :return: Array of shape (len(X_series), bins) and, if Y_series is given, array of per-bin means of the same shape
+    """
+    lengths = np.array([len(X) for X in X_series])
+    X = np.concatenate(X_series) if len(X_series) else np.zeros(0)
+    if begin_x is None:
+        begin_x = np.min(X)
+    if end_x is None:
+        end_x = np.max(X)
+    bins, discretizing_divisor = _discretizing_grid(begin_x, end_x, bins, discretizing_divisor)
+
+    # Every series gets its own range of bins, so one bincount histograms all of them
+    bin_n = _bin_numbers(X, begin_x, discretizing_divisor, bins) + np.repeat(np.arange(len(lengths))*bins, lengths)
+    size = len(lengths)*bins
+    X_discretized = np.bincount(bin_n, minlength=size).astype(np.float64).reshape(len(lengths), bins)
+    if Y_series is not None:
+        Y = np.concatenate(Y_series).astype(np.float64) if len(Y_series) else np.zeros(0)
+        Y_discretized = np.bincount(bin_n, weights=Y, minlength=size).reshape(len(lengths), bins)
+        np.divide(Y_discretized, X_discretized, out=Y_discretized, where=X_discretized > 0)
+    if normalize:
+        np.divide(X_discretized, lengths[:, None], out=X_discretized, where=lengths[:, None] > 0)
+    if Y_series is None:
+        return X_discretized
+    return X_discretized, Y_discretized
+
+
+def segment_statistics(values, offsets, percentiles=()):
+    """
+    Group-by over values split into segments values[offsets[i]:offsets[i+1]]: values are sorted
+    within segments once and every statistic is a segment reduction. Empty segments get nan
+    :return: Dictionary of arrays (one value per segment): "count", "mean", "std" (population),
+    "median", "ci95" (half-width of normal 95% confidence interval of mean) and "p<q>" for every q in percentiles
+    """
+    values = np.asarray(values, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    counts = np.diff(offsets)
+    segment_ids = np.repeat(np.arange(len(counts)), counts)
+    values = values[np.lexsort((values, segment_ids))]
+
+    nonempty = counts > 0
+    starts = offsets[:-1][nonempty]
+    mean = np.full(len(counts), np.nan)
+    mean[nonempty] = np.add.reduceat(values, starts) / counts[nonempty] if len(starts) else []
+    deviations = values - mean[segment_ids]
+    std = np.full(len(counts), np.nan)
+    std[nonempty] = np.sqrt(np.add.reduceat(np.square(deviations), starts) / counts[nonempty]) if len(starts) else []
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ci95 = np.where(counts > 1, 1.96*std/np.sqrt(counts - 1), np.nan)
+
+    def percentile(q):
+        # Linear interpolation between closest ranks, as np.percentile does
+        result = np.full(len(counts), np.nan)
+        position = q/100.0*(counts[nonempty] - 1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, counts[nonempty] - 1)
+        low_values, high_values = values[starts + lower], values[starts + upper]
+        result[nonempty] = low_values + (high_values - low_values)*(position - lower)
+        return result
+
+    result = {
+        "count" : counts,
+        "mean" : mean,
+        "std" : std,
+        "median" : percentile(50),
+        "ci95" : ci95,
+    }
+    for q in percentiles:
+        result["p{}".format(q)] = percentile(q)
+    return result
+
+
+def _filter_selection(posts, post_filter):
+    """
+    :param post_filter: PostFilter, None means all posts
+    :return: Indexes of matching posts if filter is answered by an index (tag postings, time range),
+    boolean mask of them otherwise, None for all posts
+    """
+    if post_filter is None:
+        return None
+    if not isinstance(post_filter, PostFilter):
+        raise TypeError("Post filter must be a PostFilter (see storage.post_filters), got {!r}".format(post_filter))
+    idxes = post_filter.indexes(posts)
+    return idxes if idxes is not None else post_filter.mask(posts)
+
+
+def extract_rating_by_time(posts, post_filter=None):
+    """
+    :param posts: PostStore
+    :param post_filter: PostFilter, None means all posts
+    :return: Timestamps and ratings of matching posts sorted by time
+    """
+    idxes = posts.posts_by_time(_filter_selection(posts, post_filter))
+    if not len(idxes):
         raise RuntimeError("Nothing matches filter function")
-    T, R = zip(*sorted(TR, key=lambda x: x[0]))
-    return np.asarray(T), np.asarray(R)
+    return posts.timestamps[idxes], posts.ratings[idxes]
 
 
-def extract_sorted_rating_with_time(raw_data, filter_function):
-    TR = [(v["timestamp"], v["rating"]) for v in raw_data.values() if filter_function(v)]
-    if not TR:
+def extract_sorted_rating_with_time(posts, post_filter=None):
+    """
+    :return: Timestamps and ratings of matching posts sorted by descending rating
+    """
+    idxes = posts.posts_by_rating(_filter_selection(posts, post_filter))
+    if not len(idxes):
         raise RuntimeError("Nothing matches filter function")
-    T, R = zip(*sorted(TR, key=lambda x: -x[1]))
-    return np.asarray(T), np.asarray(R)
-
-
-@save_code_based_cache("tags_filtered.pkl")
-def filter_tags_by_occurency_number(data, tag_occurencies_filter, **kwargs):
-    all_tags = dict()
-    for post in data.values():
-        for tag in post["tags"]:
-            if tag in all_tags:
-                all_tags[tag] += 1
-            else:
-                all_tags[tag] = 1
-    return sorted([k for k, v in all_tags.items() if tag_occurencies_filter(v)])
\ No newline at end of file
+    return posts.timestamps[idxes], posts.ratings[idxes]
+
+
+def filter_tags_by_occurency_number(posts, min_occurencies=None, max_occurencies=None):
+    """
+    :return: Alphabetically sorted tags occurring from min_occurencies to max_occurencies times (both inclusive)
+    """
+    return sorted(posts.tags[tag_id] for tag_id in posts.tags_by_occurency_number(min_occurencies, max_occurencies))